@@ -25,20 +25,66 @@ import os
 import struct
 import zlib
 import subprocess
-
-
-def write_uint8(fh, val):
-    fh.write(struct.pack('B', val))
-def write_uint16(fh, val):
-    fh.write(struct.pack('<H', val))
-def write_uint24(fh, val):
-    fh.write(struct.pack('B', val >> 16))
-    fh.write(struct.pack('<H', val & 0xffff))
-def write_uint32(fh, val):
-    fh.write(struct.pack('<I', val))
-def write_string(fh, s):
-    fh.write(struct.pack('B', len(s)))
-    fh.write(str.encode(s, 'ascii'))
+import multiprocessing
+
+# libdeflate (via the 'deflate' package) produces smaller zlib streams than zlib itself,
+# so use it when it's installed. The output is still read by zlib.DecompIO on the Thumby.
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+
+# Precompiled formats, so each write doesn't have to parse a format string
+_U8 = struct.Struct('B')
+_U16 = struct.Struct('<H')
+_U24 = struct.Struct('<BH')          # high byte, then the low 16 bits
+_U32 = struct.Struct('<I')
+
+
+# These pack into a preallocated bytearray at offset p, which is written out in
+# one go, and return the offset just after what they've written
+def write_uint8(buf, p, val):
+    _U8.pack_into(buf, p, val)
+    return p + 1
+def write_uint16(buf, p, val):
+    _U16.pack_into(buf, p, val)
+    return p + 2
+def write_uint24(buf, p, val):
+    _U24.pack_into(buf, p, val >> 16, val & 0xffff)
+    return p + 3
+def write_uint32(buf, p, val):
+    _U32.pack_into(buf, p, val)
+    return p + 4
+def write_string(buf, p, s):
+    p = write_uint8(buf, p, len(s))
+    buf[p:p+len(s)] = s.encode('ascii')
+    return p + len(s)
+
+
+# Files are read and compressed in chunks of this size, rather than all at once
+read_chunk_sz = 128 * 1024
+
+
+# Files smaller than this gain very little from the slowest compression levels
+small_file_sz = 4096
+
+
+# This is a top-level function so that it can be run in a worker process
+def compress_file(fname, fast):
+    with open(fname, 'rb') as ifh:
+        if deflate is not None:
+            # libdeflate can only compress a whole buffer
+            return deflate.zlib_compress(ifh.read(), 1 if fast else 12)
+        co = zlib.compressobj(1 if fast else 9)
+        compdata = bytearray()
+        while True:
+            chunk = ifh.read(read_chunk_sz)
+            if not chunk:
+                break
+            compdata += co.compress(chunk)
+        compdata += co.flush()
+    return compdata
 
 
 class FileEntry:
@@ -51,47 +97,63 @@ class FileEntry:
         if self.target_fname.startswith('/'):
             self.target_fname = self.target_fname[1:]
         self.unpack_sz = os.stat(self.local_fname).st_size
+        self.fast = self.unpack_sz < small_file_sz
 
-    def write_file(self, fh):
-        self.offset = fh.tell()
-        with open(self.local_fname, 'rb') as ifh:
-            data = ifh.read()
-        compdata = zlib.compress(data, 9)
+    # base is the file offset that buf will be written at
+    def write_file(self, buf, p, base, compdata):
+        self.offset = base + p
         self.pack_sz = len(compdata)
-        fh.write(compdata)
- 
-    def write_entry(self, fh):
-        print(self.target_fname, self.offset, self.unpack_sz)
-        write_string(fh, self.target_fname)
-        write_uint24(fh, self.offset)
-        write_uint24(fh, self.unpack_sz)
+        buf[p:p+self.pack_sz] = compdata
+        return p + self.pack_sz
+
+    # Length-prefixed name, then the offset and size
+    def entry_size(self):
+        return 1 + len(self.target_fname) + 3 + 3
+
+    def write_entry(self, buf, p):
+        p = write_string(buf, p, self.target_fname)
+        p = write_uint24(buf, p, self.offset)
+        return write_uint24(buf, p, self.unpack_sz)
 
 
 class SfxBuilder:
-    def __init__(self, inst_files):
+    def __init__(self, inst_files, verbose=False):
         self.inst_files = [FileEntry(fn) for fn in inst_files]
+        self.verbose = verbose
 
     def generate(self, outname):
+        # Compression is the slow part, and each file can be compressed independently
+        with multiprocessing.Pool() as pool:
+            compdatas = pool.starmap(compress_file, [(f.local_fname, f.fast) for f in self.inst_files])
+
         with open(outname, 'ab') as fh:
+            # Everything that's appended is built in memory first, then written with a single call
+            base = fh.tell()
+            # File count and total size, the entries, then the table length and magic
+            tab_sz = 1 + 4 + sum(( f.entry_size() for f in self.inst_files ))
+            buf = bytearray(sum(( len(c) for c in compdatas )) + tab_sz + 2 + 4)
+            p = 0
+            for f, compdata in zip(self.inst_files, compdatas):
+                p = f.write_file(buf, p, base, compdata)
+            p = write_uint8(buf, p, len(self.inst_files))
+            p = write_uint32(buf, p, sum(( f.unpack_sz for f in self.inst_files )))
             for f in self.inst_files:
-                f.write_file(fh)
-            inst_tab_start = fh.tell()
-            write_uint8(fh, len(self.inst_files))
-            write_uint32(fh, sum(( f.unpack_sz for f in self.inst_files )))
-            for f in self.inst_files:
-                f.write_entry(fh)
-            inst_tab_end = fh.tell()
-            write_uint16(fh, inst_tab_end - inst_tab_start)
-            write_uint32(fh, 0x01584653)        # 'SFX\x01'
+                if self.verbose:
+                    print(f.target_fname, f.offset, f.unpack_sz)
+                p = f.write_entry(buf, p)
+            p = write_uint16(buf, p, tab_sz)
+            write_uint32(buf, p, 0x01584653)     # 'SFX\x01'
+            fh.write(buf)
 
 
 def main():
     parser = argparse.ArgumentParser(description='Thumby SFX builder')
     parser.add_argument('target', help='MPY file to be modified')
     parser.add_argument('payload', nargs='+', help='File(s) to add to installer')
+    parser.add_argument('-v', '--verbose', action='store_true', help='List the files added to installer')
     parser.epilog = 'Use <local>:<remote> to specify different paths for payload'
     args = parser.parse_args()
-    sfx_build = SfxBuilder(args.payload)
+    sfx_build = SfxBuilder(args.payload, args.verbose)
     sfx_build.generate(args.target)
 
 if __name__ == "__main__":
@@ -26,7 +26,6 @@ from machine import Pin, SPI, freq, soft_reset, mem32
 import framebuf
 import utime
 from micropython import kbd_intr
-from struct import unpack
 import zlib
 
 kbd_intr(-1)
@@ -39,9 +38,13 @@ fb = framebuf.FrameBuffer(disp.buffer, disp.width, disp.height, framebuf.MONO_VL
 swA = Pin(27, Pin.IN, Pin.PULL_UP) # right (A) action button
 swB = Pin(24, Pin.IN, Pin.PULL_UP) # left (B) action button
 
-buff = bytearray(512)
+# A larger buffer means fewer decompression calls and file writes per file
+buff = bytearray(4096)
 buffmv = memoryview(buff)
 
+# Redrawing the progress display is slow, so only do it after this many bytes
+update_interval = const(2048)
+
 
 def wait_button():
     while swA.value() and swB.value():
@@ -52,52 +55,76 @@ def wait_button():
 
 
 
+# XORs the bar between columns x0 and x1, so it can be extended a bit at a time
 @micropython.viper
-def draw_bar(width:int):
+def draw_bar(x0:int, x1:int):
     buffer:ptr8 = ptr8(disp.buffer)
-    o:int = 216
-    eo:int = 216 + width
+    buf32:ptr32 = ptr32(disp.buffer)
+    o:int = 216 + x0
+    eo:int = 216 + x1
     if eo > 288:
         eo = 288
+    # Bytes up to the next word boundary, then whole words, then what's left over
+    while (o & 3) and o < eo:
+        buffer[o] ^= 0xff
+        o += 1
+    while o + 4 <= eo:
+        buf32[o >> 2] ^= -1
+        o += 4
     while o < eo:
         buffer[o] ^= 0xff
         o += 1
 
 
 
-def mkdirp_basename(path):
-    os.chdir('/')
-    for d in path.split('/')[0:-1]:
-        if not d in os.listdir():
-            os.mkdir(d)
-        os.chdir(d)
-    os.chdir('/')
+# uint24 values are stored as a high byte followed by a little-endian uint16
+def uint24_from(b, o):
+    return (b[o] << 16) | b[o+1] | (b[o+2] << 8)
 
 
 
 class FileEntry:
-    def __init__(self, sfx):
+    def __init__(self, sfx, fname, offset, unpack_sz):
         self.sfx = sfx
-        self.fname = sfx.read_string()
-        self.offset = sfx.read_uint24()
-        self.unpack_sz = sfx.read_uint24()
+        self.fname = fname
+        self.offset = offset
+        self.unpack_sz = unpack_sz
         #print(self.fname)
 
     def extract(self):
         global buff
         global buffmv
         #print(self.fname)
-        mkdirp_basename(self.fname)
+        sfx._mkdirp(self.fname)
         sz = self.unpack_sz
         sfx.fh.seek(self.offset)
         zs = zlib.DecompIO(sfx.fh)
+        pending = 0
+        # Local aliases save an attribute lookup per call in the loop
+        readinto = zs.readinto
+        update = sfx.extract_update
+        _buff = buff
+        mv = buffmv
+        bufsz = len(_buff)
         with open(self.fname, 'wb') as ofh:
-            while sz != 0:
-                rb = zs.readinto(buff)
-                #print(rb, sz, self.unpack_sz)
-                ofh.write(buffmv[0:rb])
-                sfx.extract_update(rb)
-                sz -= rb
+            write = ofh.write
+            # readinto always fills the buffer until the end of the stream, so the
+            # whole buffer can be written without slicing a new memoryview each time
+            while sz > bufsz:
+                readinto(_buff)
+                write(_buff)
+                pending += bufsz
+                if pending >= update_interval:
+                    update(pending)
+                    pending = 0
+                sz -= bufsz
+            # The last part of the file, or all of it if it fits in the buffer
+            if sz != 0:
+                readinto(mv[0:sz])
+                write(mv[0:sz])
+                pending += sz
+        if pending != 0:
+            update(pending)
 
 
 
@@ -105,17 +132,20 @@ class SelfExtractor:
     def __init__(self):
         self.fh = None
         self.path = sys.modules[__name__].__file__
+        self.path_ren = self.path + '.tmp'
+        self._made = set()
 
 
     def disp_fail(self, lines):
         fb.fill(0)
+        text = fb.text
         y = 0
         for line in lines:
             if line[0] == '!':
                 y += 6
-                fb.text(line[1:], 0, y, 1)
+                text(line[1:], 0, y, 1)
             else:
-                fb.text(line, 0, y, 1)
+                text(line, 0, y, 1)
             y += 9
         disp.show()
         wait_button()
@@ -123,40 +153,46 @@ class SelfExtractor:
         soft_reset()
 
 
+    # Only the parts of the display that have changed are redrawn, and nothing
+    # is sent to the display at all if it would look the same
     def extract_update(self, bytecount):
         self.totwritten += bytecount
-        fb.fill(0)
-        fb.text('Extract..', 0, 0, 1)
-        fb.text('%d/%d' % (self.cur_file, self.filecnt), 24, 12, 1)
         pcnt = (self.totwritten * 100) // self.totalsize
-        fb.text('%d%%' % pcnt, 24, 24, 1)
         barw = (self.totwritten * 76) // self.totalsize
-        draw_bar(barw)
+        if self.cur_file == self._last_cur_file and pcnt == self._last_pcnt and barw == self._last_barw:
+            return
+        fill_rect = fb.fill_rect
+        text = fb.text
+        if self.cur_file != self._last_cur_file:
+            fill_rect(24, 12, 48, 8, 0)
+            text('%d/%d' % (self.cur_file, self.filecnt), 24, 12, 1)
+            self._last_cur_file = self.cur_file
+        if pcnt != self._last_pcnt:
+            # The bar is XORed over the percentage row, so redraw it all
+            fill_rect(0, 24, 72, 8, 0)
+            text('%d%%' % pcnt, 24, 24, 1)
+            draw_bar(0, barw)
+            self._last_pcnt = pcnt
+        elif barw != self._last_barw:
+            draw_bar(self._last_barw, barw)
+        self._last_barw = barw
         disp.show()
 
 
-    def read_uint8(self):
-        return unpack('B', self.fh.read(1))[0]
-    def read_uint16(self):
-        return unpack('<H', self.fh.read(2))[0]
-    def read_uint24(self):
-        h = unpack('B', self.fh.read(1))[0] << 16
-        return h | unpack('<H', self.fh.read(2))[0]
-    def read_uint32(self):
-        return unpack('<I', self.fh.read(4))[0]
-    def read_string(self):
-        l = unpack('B', self.fh.read(1))[0]
-        return self.fh.read(l).decode('ascii')
-
-
     def load_info(self):
-        self.fh.seek(-4, 2)
-        if self.read_uint32() != 0x01584653:                   # 'SFX\x01'
-            self.disp_fail(('File', 'corrupt', '!Re-upload'))
+        # The file ends with the index table length and the magic number, so read them together.
+        # MicroPython's struct module has no precompiled Struct objects, so rather than
+        # parsing a format string on every call we decode the bytes directly.
         self.fh.seek(-6, 2)
-        self.fh.seek(-(self.read_uint16() + 6), 2)
-        self.filecnt = self.read_uint8()
-        self.totalsize = self.read_uint32()
+        tail = self.fh.read(6)
+        if tail[2:6] != b'SFX\x01':
+            self.disp_fail(('File', 'corrupt', '!Re-upload'))
+        tab_len = int.from_bytes(tail[0:2], 'little')
+        self.fh.seek(-(tab_len + 6), 2)
+        # Read the whole index table with one call, and parse the entries from memory
+        tab = self.fh.read(tab_len)
+        self.filecnt = tab[0]
+        self.totalsize = int.from_bytes(tab[1:5], 'little')
         #print(self.filecnt, self.totalsize)
 
         stat = os.statvfs('/')
@@ -164,18 +200,56 @@ class SelfExtractor:
         if self.totalsize > totfree:
             self.disp_fail(('Need more', 'space', '!%ukB' % ((self.totalsize - totfree + 1023) // 1024)))
 
-        self.filelist = [ FileEntry(self) for _ in range(self.filecnt) ]
-
-        if sum((fe.unpack_sz for fe in self.filelist)) != self.totalsize:
+        # Each entry is a length-prefixed name, then the offset and size as uint24s
+        self.filelist = []
+        append = self.filelist.append
+        accum = 0
+        p = 5
+        for _ in range(self.filecnt):
+            l = tab[p]
+            fname = tab[p+1:p+1+l].decode('ascii')
+            p += 1 + l
+            offset = uint24_from(tab, p)
+            unpack_sz = uint24_from(tab, p + 3)
+            p += 6
+            append(FileEntry(self, fname, offset, unpack_sz))
+            accum += unpack_sz
+
+        if accum != self.totalsize:
             self.disp_fail(('File', 'corrupt', '!Re-upload'))
 
 
+    # Creates the directories leading up to path. The ones already done are remembered,
+    # so files in the same directory don't have to scan the filesystem again.
+    def _mkdirp(self, path):
+        made = self._made
+        prefix = ''
+        for d in path.split('/')[0:-1]:
+            prefix += '/' + d
+            if prefix in made:
+                continue
+            try:
+                os.mkdir(prefix)
+            except OSError:
+                pass
+            made.add(prefix)
+
+
     def extract(self):
+        # File names are relative to the root
+        os.chdir('/')
         self.cur_file = 0
         self.totwritten = 0
+        self._last_cur_file = -1
+        self._last_pcnt = -1
+        self._last_barw = 0
+        fb.fill(0)
+        fb.text('Extract..', 0, 0, 1)
         for i, f in enumerate(self.filelist):
             self.cur_file = i + 1
-            self.extract_update(0)
+            # Later files update the display as soon as they've written some data
+            if i == 0:
+                self.extract_update(0)
             f.extract()
 
 
@@ -197,7 +271,7 @@ class SelfExtractor:
                 self.fh = fh
                 self.load_info()
 
-            path_ren = self.path + '.tmp'
+            path_ren = self.path_ren
             os.rename(self.path, path_ren)
             #path_ren = self.path
             try:
@@ -54,7 +54,7 @@
 
 from micropython import kbd_intr, mem_info
 import utime
-from machine import Pin, freq
+from machine import Pin, freq, mem32
 import random
 import gc
 from math import sin, pi, sqrt
@@ -82,6 +82,11 @@ swU = Pin(4, Pin.IN, Pin.PULL_UP) # D-pad up
 swD = Pin(6, Pin.IN, Pin.PULL_UP) # D-pad down
 swA = Pin(27, Pin.IN, Pin.PULL_UP) # right (A) action button
 swB = Pin(24, Pin.IN, Pin.PULL_UP) # left (B) action button
+# The pins are set up above, but it's quicker to read them all at once from the
+# SIO GPIO_IN register than to call value() on each one
+sio_gpio_in = const(0xd0000004)
+swL_bit = const(3) ; swR_bit = const(5) ; swU_bit = const(4) ; swD_bit = const(6)
+swA_mask = const(1 << 27) ; swB_mask = const(1 << 24)
 
 disp = SSD1306_SPI_Grey(True)
 
@@ -89,6 +94,10 @@ disp = SSD1306_SPI_Grey(True)
 frame_rate = const(50)
 frame_microsec = int(1000000.0 / frame_rate)
 
+# Set this to True to calculate and display the FPS. When it's False the compiler
+# leaves that code out completely.
+show_fps = const(False)
+
 # fixed point functions
 fpone = const(1 << 16)
 
@@ -108,15 +117,25 @@ def fp2float(v:int) -> float:
 def float2fp(v:float) -> int:
     return int(v * 65536)
 
-@micropython.viper
-def fpmul(a:int, b:int) -> int:
-    return (a >> 6) * (b >> 6) >> 4
+# The multiplies are called so often that they're written in assembler, which has
+# less overhead than a viper function. They're the same as:
+#   (a >> 6) * (b >> 6) >> 4
+@micropython.asm_thumb
+def fpmul(r0, r1):
+    asr(r0, r0, 6)
+    asr(r1, r1, 6)
+    mul(r0, r1)
+    asr(r0, r0, 4)
 
 # Slightly different scaling used for the rotation calculations
 #   https://www.flipcode.com/archives/3D_Graphics_on_Mobile_Devices-Part_2_Fixed_Point_Math.shtml
-@micropython.viper
-def fpmul_rot(a:int, b:int) -> int:
-    return ((a >> 2) * (b >> 2)) >> 12
+#   ((a >> 2) * (b >> 2)) >> 12
+@micropython.asm_thumb
+def fpmul_rot(r0, r1):
+    asr(r0, r0, 2)
+    asr(r1, r1, 2)
+    mul(r0, r1)
+    asr(r0, r0, 12)
 
 @micropython.viper
 def fpdiv(a:int, b:int) -> int:
@@ -124,14 +143,12 @@ def fpdiv(a:int, b:int) -> int:
 
 
 # Sine table. Angles in [0..sintab_sz)
-# We only need angles [0..0.5pi)... the other quadrants can be calculated from those
+# We only need angles [0..0.5pi) to calculate the other quadrants, but the whole table is
+# only 4kB, and storing all of it means a lookup doesn't need any adjustment
 sintab_sz = const(1024)
 sintab_mask = const(sintab_sz - 1)
-sintab_quart_mask = const(sintab_mask >> 2)
-sintab_half_mask = const(sintab_mask >> 1)
 sintab_sz_quart = const(sintab_sz >> 2)
-sintab_sz_half = const(sintab_sz >> 1)
-sintab:array = array('l', [ int(sin(i * ((2 * pi) / sintab_sz)) * 65536) for i in range(sintab_sz // 4)])
+sintab:array = array('l', [ int(sin(i * ((2 * pi) / sintab_sz)) * 65536) for i in range(sintab_sz)])
 
 
 # Ordered dithering. This generates a series of <shadecnt> tiles of size dith_w*dith_h
@@ -166,6 +183,10 @@ for i in range(shadecnt):
     dither2.append(array('l', [ fill_smallint(sum((1 if v & 2 else 0)<<i for i,v in enumerate(r))) for r in d ]))
 d = None
 bayer_mat = None
+# The same tiles in flat arrays, with the rows for shade s starting at s * dith_h,
+# so they can be read directly through a pointer
+dither1_flat = array('l', [v for t in dither1 for v in t])
+dither2_flat = array('l', [v for t in dither2 for v in t])
 
 
 # Parameters for projection mapping
@@ -184,50 +205,59 @@ light_ambient = const(3)
 # sine and cosine lookup
 @micropython.viper
 def fpsin(a:int) -> int:
-    a &= sintab_mask
-    ta:int = a & sintab_quart_mask
-    if (a & sintab_half_mask) >= sintab_sz_quart:
-        ta = sintab_quart_mask - ta
-    v:int = ptr32(sintab)[ta]
-    if a >= sintab_sz_half:
-        return 0 - v
-    return v
+    return ptr32(sintab)[a & sintab_mask]
 
 # cos(x) == sin(0.5pi + x)
 @micropython.viper
 def fpcos(a:int) -> int:
-    return int(fpsin(a + sintab_sz_quart))
+    return ptr32(sintab)[(a + sintab_sz_quart) & sintab_mask]
+
+# Both at once, written to out[0] and out[1], for when we need the pair.
+# This saves a function call, and returning a tuple would allocate heap memory.
+@micropython.viper
+def fpsincos(a:int, out:ptr32):
+    tab:ptr32 = ptr32(sintab)
+    out[0] = tab[a & sintab_mask]
+    out[1] = tab[(a + sintab_sz_quart) & sintab_mask]
 
 
 
 # Used for integer square root calculation
-#   https://graphics.stanford.edu/~seander/bithacks.html#IntegerLogLookup
-log_table = array('l', [0] * 256)
-for i in range(2, 256):
-    log_table[i] = 1 + log_table[i // 2]
-log_table[0] = -1
+# The RP2040's Cortex-M0+ has no count leading zeros instruction, so we use a de Bruijn sequence.
+# Setting all the bits below the highest one and multiplying by the sequence puts a unique
+# value in the top 5 bits, which indexes a table of bit positions.
+#   https://graphics.stanford.edu/~seander/bithacks.html#IntegerLogDeBruijn
+debruijn_table = bytearray([1, 10, 2, 11, 14, 22, 3, 30, 12, 15, 17, 19, 23, 26, 4, 31,
+                            9, 13, 21, 29, 16, 18, 25, 8, 20, 28, 24, 7, 27, 6, 5, 32])
 
 @micropython.viper
 def bit_length(v:int) -> int:
-    tt:int = v >> 16
-    if tt != 0:
-        t:int = tt >> 8
-        if int(t) != 0:
-            return 25 + int(log_table[t])
-        return 17 + int(log_table[tt])
-    else:
-        t:int = v >> 8
-        if int(t) != 0:
-            return 9 + int(log_table[t])
-        return 1 + int(log_table[v])
+    if v == 0:
+        return 0
+    v |= v >> 1
+    v |= v >> 2
+    v |= v >> 4
+    v |= v >> 8
+    v |= v >> 16
+    return ptr8(debruijn_table)[((v * 0x07C4ACDD) >> 27) & 31]
 
 
+# Square roots of the top bits of a number, rounded up, in Q4 fixed point.
+# These give a starting estimate for isqrt() that's always at least the answer, and
+# usually within a couple of iterations of it.
+isqrt_table = array('H', [int(sqrt(i + 1) * 16 + 0.999999) for i in range(256)])
+
 # Quick integer square root function, for vector normalisation
 #   https://stackoverflow.com/a/53983683
 @micropython.viper
 def isqrt(n:int) -> int:
     if n > 0:
-        x:int = 1 << (int(bit_length(n)) + 1 >> 1)
+        # use the top 7 or 8 bits (an even shift keeps the square root exact) to look up the estimate
+        sh:int = int(bit_length(n)) - 8
+        if sh < 0:
+            sh = 0
+        h:int = (sh + 1) >> 1
+        x:int = ((int(ptr16(isqrt_table)[n >> (h << 1)]) << h) + 15) >> 4
         while True:
             y:int = (x + n // x) >> 1
             if y >= x:
@@ -261,10 +291,9 @@ def vect_norm(x:int,y:int,z:int):
 # but it's one I used ages ago so I had it in my notes.
 @micropython.viper
 def project_part(c:int, z:int) -> int:
-    a:int = fpdiv(c, z)
-    b:int = int(a) * project_d
-    g:int = int(b) >> 8
-    return g
+    # this is fpdiv(c, z), done inline to save a function call
+    a:int = ((c << 6) // (z >> 6)) >> 4
+    return (a * project_d) >> 8
 
 
 # we won't use this as returning multiple values to unpack allocates heap memory
@@ -331,19 +360,68 @@ def hline_dither(x0:int, x1:int, y:int, dither_row1:int, dither_row2:int, dith_x
     buffer1 = ptr8(disp.buffer1)
     buffer2 = ptr8(disp.buffer2)
 
+    # The dither bit picks the mask without branching, as the pattern isn't predictable
     for ww in range(index+x0, index+x1):
-        if dither_row1 & 1:
-            buffer1[ww] |= mask
-        else:
-            buffer1[ww] &= imask
+        buffer1[ww] = (buffer1[ww] & imask) | ((dither_row1 & 1) * mask)
         dither_row1 >>= 1
-        if dither_row2 & 1:
-            buffer2[ww] |= mask
-        else:
-            buffer2[ww] &= imask
+        buffer2[ww] = (buffer2[ww] & imask) | ((dither_row2 & 1) * mask)
         dither_row2 >>= 1
 
 
+# Draws the four segments of a road row in one go, alternating between two dither rows.
+# This is the same as calling hline_dither() for each segment, but the row setup is only done once.
+@micropython.viper
+def hline_dither4(cx:int, x:int, xh:int, y:int, dA1:int, dA2:int, dB1:int, dB2:int):
+    index:int = (y >> 3) * 72
+    offset:int = y & 0x07
+    mask:int = 1 << offset
+    imask:int = 255-mask
+
+    buffer1 = ptr8(disp.buffer1)
+    buffer2 = ptr8(disp.buffer2)
+
+    x0:int = cx - x
+    x1:int = 0
+    seg:int = 0
+    while seg < 4:
+        if seg == 0:
+            x1 = cx - xh
+        elif seg == 1:
+            x1 = cx
+        elif seg == 2:
+            x1 = cx + xh
+        else:
+            x1 = cx + x
+        if seg & 1:
+            dither_row1:int = dB1
+            dither_row2:int = dB2
+        else:
+            dither_row1:int = dA1
+            dither_row2:int = dA2
+
+        c0:int = x0
+        if c0 < 0:
+            c0 = 0
+        elif c0 > 71:
+            c0 = 71
+        c1:int = x1
+        if c1 < 0:
+            c1 = 0
+        elif c1 > 71:
+            c1 = 71
+
+        dither_row1 >>= c0 & dith_w_mask
+        dither_row2 >>= c0 & dith_w_mask
+        for ww in range(index+c0, index+c1):
+            buffer1[ww] = (buffer1[ww] & imask) | ((dither_row1 & 1) * mask)
+            dither_row1 >>= 1
+            buffer2[ww] = (buffer2[ww] & imask) | ((dither_row2 & 1) * mask)
+            dither_row2 >>= 1
+
+        x0 = x1
+        seg += 1
+
+
 # To draw filled polygons I used a really neat idea from
 #   https://stackoverflow.com/a/7870925
 # I hadn't come across this approach before, but it was perfect for the Thumby with its small
@@ -354,6 +432,8 @@ def hline_dither(x0:int, x1:int, y:int, dither_row1:int, dither_row2:int, dith_x
 
 # This function is the Bresenham line drawing algorithm.
 # Note calculation of negatives with '0 - x'. @micropython.viper doesn't seem to support unary minus
+# The min/max updates avoid branching by using the sign of the difference as a mask, and
+# the row check uses an unsigned comparison to catch negative rows too.
 @micropython.viper
 def rastline(x0:int, y0:int, x1:int, y1:int, rastmin:ptr8, rastmax:ptr8):
     dx:int = x1 - x0
@@ -369,9 +449,13 @@ def rastline(x0:int, y0:int, x1:int, y1:int, rastmin:ptr8, rastmax:ptr8):
     if dx > dy:
         err:int = dx >> 1
         while x != x1:
-            if 0 <= y < 40:
-                if x < rastmin[y]: rastmin[y] = x
-                if x > rastmax[y]: rastmax[y] = x
+            if uint(y) < uint(40):
+                m:int = rastmin[y]
+                d:int = x - m
+                rastmin[y] = m + (d & (d >> 31))
+                m = rastmax[y]
+                d = m - x
+                rastmax[y] = m - (d & (d >> 31))
             err -= dy
             if err < 0:
                 y += sy
@@ -380,20 +464,37 @@ def rastline(x0:int, y0:int, x1:int, y1:int, rastmin:ptr8, rastmax:ptr8):
     else:
         err:int = dy >> 1
         while y != y1:
-            if 0 <= y < 40:
-                if x < rastmin[y]: rastmin[y] = x
-                if x > rastmax[y]: rastmax[y] = x
+            if uint(y) < uint(40):
+                m:int = rastmin[y]
+                d:int = x - m
+                rastmin[y] = m + (d & (d >> 31))
+                m = rastmax[y]
+                d = m - x
+                rastmax[y] = m - (d & (d >> 31))
             err -= dx
             if err < 0:
                 x += sx
                 err += dy
             y += sy
-    if 0 <= y < 40:
-        if x < rastmin[y]: rastmin[y] = x
-        if x > rastmax[y]: rastmax[y] = x
+    if uint(y) < uint(40):
+        m:int = rastmin[y]
+        d:int = x - m
+        rastmin[y] = m + (d & (d >> 31))
+        m = rastmax[y]
+        d = m - x
+        rastmax[y] = m - (d & (d >> 31))
 
 
 
+# The road's per-frame values are kept in an array, so that viper code can read and write
+# them directly rather than through attribute lookups. These are the indices into it.
+road_seg_z = const(0)
+road_seg_dx = const(1)
+road_zoff = const(2)
+road_botseg_dx = const(3)
+road_z_horizon = const(4)
+road_z_front = const(5)
+
 class Road:
     # We generate the curves on the fly
     #  https://codeincomplete.com/articles/javascript-racer-v2-curves/
@@ -405,7 +506,6 @@ class Road:
     StateEaseOut = const(2)
 
     def __init__(self, road_width, road_horizon, road_y, c1min, c1max, c2min, c2max):
-        self.zoff = 0
         maxx = float2fp(road_width/2)
         self.zmap = array('l', [0] * 19)
         # http://www.extentofthejam.com/pseudo/ : A More Accurate Road - Using a Z Map
@@ -420,31 +520,33 @@ class Road:
         self.edgerast = rastmax
 
         self.road_horizon = road_horizon
-        self.z_horizon = self.zmap[road_horizon]
-        self.z_front = self.zmap[18]
-
-        col_scale = 1 / (self.z_front - self.z_horizon)
-        self.dithA1 = array('O', [None] * 19)
-        self.dithB1 = array('O', [None] * 19)
-        self.dithA2 = array('O', [None] * 19)
-        self.dithB2 = array('O', [None] * 19)
+        z_horizon = self.zmap[road_horizon]
+        z_front = self.zmap[18]
+
+        col_scale = 1 / (z_front - z_horizon)
+        # The dither tile rows for each road row, packed together so they can be read with
+        # a single index. For each tile row there's A1, B1, A2, B2 (A/B colour, 1/2 plane).
+        dith_pack = array('l', [0] * (19 * dith_h * 4))
         c1 = c1max - c1min ; c2 = c2max - c2min
         for y in range(19):
-            z = (self.zmap[y] - self.z_horizon) * col_scale
+            z = (self.zmap[y] - z_horizon) * col_scale
             c1s = c1 * z if z >= 0 else 0
             c2s = c2 * z if z >= 0 else 0
             c1s = round(c1s + c1min + 0.5)
             c2s = round(c2s + c2min + 0.5)
             if c1s > 15: c1s = 15
             if c2s > 15: c2s = 15
-            self.dithA1[y] = dither1[c1s]
-            self.dithB1[y] = dither1[c2s]
-            self.dithA2[y] = dither2[c1s]
-            self.dithB2[y] = dither2[c2s]
-
-        self.botseg_dx = 0
-        self.seg_dx = 0
-        self.seg_z = self.z_horizon
+            o = y * dith_h * 4
+            for dy in range(dith_h):
+                dith_pack[o]   = dither1[c1s][dy]
+                dith_pack[o+1] = dither1[c2s][dy]
+                dith_pack[o+2] = dither2[c1s][dy]
+                dith_pack[o+3] = dither2[c2s][dy]
+                o += 4
+        self.dith_pack = dith_pack
+
+        # seg_z, seg_dx, zoff, botseg_dx, z_horizon, z_front
+        self.state = array('l', [z_horizon, 0, 0, 0, z_horizon, z_front])
 
         self.curve_state = Road.StateEaseIn
         self.curve_dx = random.choice(Road.curve_dx_opts)
@@ -460,16 +562,14 @@ class Road:
     def draw(self) -> int:
         zmap:ptr32 = ptr32(self.zmap)
         edgerast:ptr8 = ptr8(self.edgerast)
-        zoff:list = int(self.zoff)
-        dithA1 = self.dithA1
-        dithB1 = self.dithB1
-        dithA2 = self.dithA2
-        dithB2 = self.dithB2
+        st:ptr32 = ptr32(self.state)
+        zoff:int = st[road_zoff]
+        dith_pack:ptr32 = ptr32(self.dith_pack)
         ddx:int = 0
-        seg_z:int = int(self.seg_z)
-        seg_dx:int = int(self.seg_dx)
+        seg_z:int = st[road_seg_z]
+        seg_dx:int = st[road_seg_dx]
         cxfp:int = (36 << 16) + (seg_dx << 3)
-        botseg_dx:int = int(self.botseg_dx)
+        botseg_dx:int = st[road_botseg_dx]
         for y in range(18,int(self.road_horizon),-1):
             z:int = int(zmap[y])
             zw:int = z - zoff
@@ -487,40 +587,34 @@ class Road:
 
             c:int = (zw >> (5+16)) & 1
             dith_y:int = (y-(zoff>>18)) & dith_h_mask
-            if c:
-                dA1:array = dithA1[y][dith_y]
-                dB1:array = dithB1[y][dith_y]
-                dA2:array = dithA2[y][dith_y]
-                dB2:array = dithB2[y][dith_y]
-            else:
-                dA1:array = dithB1[y][dith_y]
-                dB1:array = dithA1[y][dith_y]
-                dA2:array = dithB2[y][dith_y]
-                dB2:array = dithA2[y][dith_y]
-            hline_dither(cx-x , cx-xh, yy, dA1, dA2, 0)
-            hline_dither(cx-xh, cx   , yy, dB1, dB2, 0)
-            hline_dither(cx   , cx+xh, yy, dA1, dA2, 0)
-            hline_dither(cx+xh, cx+x , yy, dB1, dB2, 0)
+            # swap the A and B colours on alternate segments
+            o:int = (y * (dith_h * 4)) + (dith_y << 2) + (c ^ 1)
+            dA1:int = dith_pack[o]
+            dB1:int = dith_pack[o ^ 1]
+            dA2:int = dith_pack[o + 2]
+            dB2:int = dith_pack[(o ^ 1) + 2]
+            hline_dither4(cx, x, xh, yy, dA1, dA2, dB1, dB2)
         return cx
 
     # Update the z position based on a given speed, and also switch to the next
     # segment if necessary.
     @micropython.native
     def update(self, speed):
-        seg_z = self.seg_z + speed
-        if seg_z > int(self.z_front):
-            self.botseg_dx = self.seg_dx
-            self.seg_z = self.z_horizon
-            #self.seg_z = self.z_horizon - (seg_z - int(self.z_front))
+        st = self.state
+        seg_z = st[road_seg_z] + speed
+        if seg_z > st[road_z_front]:
+            st[road_botseg_dx] = st[road_seg_dx]
+            st[road_seg_z] = st[road_z_horizon]
+            #st[road_seg_z] = st[road_z_horizon] - (seg_z - st[road_z_front])
 
             self.curve_len -= 1
             if self.curve_state == Road.StateEaseIn:
                 if self.curve_len == 0:
                     self.curve_len = random.choice(Road.curve_len_opts)
                     self.curve_state = Road.StateStraight
-                    self.seg_dx = self.curve_dx
+                    st[road_seg_dx] = self.curve_dx
                 else:
-                    self.seg_dx = fpmul(self.curve_dx, fpmul(self.curve_n, self.curve_n))
+                    st[road_seg_dx] = fpmul(self.curve_dx, fpmul(self.curve_n, self.curve_n))
                     self.curve_n += self.curve_inc
             elif self.curve_state == Road.StateStraight:
                 if self.curve_len == 0:
@@ -535,50 +629,81 @@ class Road:
                     self.curve_state = Road.StateEaseIn
                     self.curve_inc = fpone // self.curve_len
                     self.curve_n = 0
-                    self.seg_dx = 0
+                    st[road_seg_dx] = 0
                 else:
-                    self.seg_dx = self.curve_dx + fpmul(-self.curve_dx, (fpone - fpmul(fpone - self.curve_n, fpone - self.curve_n)))
+                    st[road_seg_dx] = self.curve_dx + fpmul(-self.curve_dx, (fpone - fpmul(fpone - self.curve_n, fpone - self.curve_n)))
                     self.curve_n += self.curve_inc
         else:
-            self.seg_z = seg_z
-        self.zoff = (int(self.zoff) + speed) & 0x0fffffff
+            st[road_seg_z] = seg_z
+        st[road_zoff] = (st[road_zoff] + speed) & 0x0fffffff
 
 
 
 class Stars:
+    # Each star's x, y, z and shade are kept in separate arrays, so draw_update
+    # can access them directly through pointers
     def __init__(self, cnt):
-        stars = array('O', [None] * cnt)
-        for i in range(cnt):
-            stars[i] = array('l', [random.randrange(-200<<16, 200<<16),
-                          random.randrange(10<<16, 100<<16),
-                          random.randrange(-1000<<16, 100<<16),
-                          random.randrange(1,4)])
-        self.stars = stars
+        self.cnt = cnt
+        self.sx = array('l', [random.randrange(-200<<16, 200<<16) for _ in range(cnt)])
+        self.sy = array('l', [random.randrange(10<<16, 100<<16) for _ in range(cnt)])
+        self.sz = array('l', [random.randrange(-1000<<16, 100<<16) for _ in range(cnt)])
+        self.sb = array('l', [random.randrange(1,4) for _ in range(cnt)])
 
-    @micropython.native
-    def draw_update(self, xcentre, ycentre, xdelta, speed):
+    @micropython.viper
+    def draw_update(self, xcentre:int, ycentre:int, xdelta:int, speed:int):
+        sx:ptr32 = ptr32(self.sx)
+        sy:ptr32 = ptr32(self.sy)
+        sz:ptr32 = ptr32(self.sz)
+        sb:ptr32 = ptr32(self.sb)
+        buffer1:ptr8 = ptr8(disp.buffer1)
+        buffer2:ptr8 = ptr8(disp.buffer2)
+        cnt:int = int(self.cnt)
         xcentre -= 36
         ycentre -= 20
-        for s in self.stars:
+        i:int = 0
+        while i < cnt:
             # There are probably better ways to create a starfield, but we can just
             # use the 3D projection function.
-            #x,y = project(s[0], s[1], s[2])
-            x = project_x(s[0], s[2]) + xcentre
-            y = project_y(s[1], s[2]) + ycentre
-            disp.pixel(x, y, s[3])
-            s[2] += speed
-
-            if not (0 <= x < 72 and 0 <= y < 40):
+            # The projection is the same as project_x() and project_y(), but done inline
+            # to save the nested function calls for each star
+            z:int = sz[i]
+            zd:int = (z - project_z_fp) >> 6
+            x:int = 36 - (((((sx[i] << 6) // zd) >> 4) * project_d) >> 8) + xcentre
+            y:int = 20 + (((((sy[i] << 6) // zd) >> 4) * project_d) >> 8) + ycentre
+            sz[i] = z + speed
+
+            if x < 0 or x >= 72 or y < 0 or y >= 40:
                 # if a star goes off the side of the screen, re-initialise it
                 # at a random position in the distance.
-                s[0] = random.randrange(-200<<16, 200<<16)
-                s[1] = random.randrange(10<<16, 100<<16)
-                s[2] = random.randrange(-1000<<16, -500<<16)
-                s[3] = random.randrange(1,4)
+                sx[i] = int(random.randrange(-200<<16, 200<<16))
+                sy[i] = int(random.randrange(10<<16, 100<<16))
+                sz[i] = int(random.randrange(-1000<<16, -500<<16))
+                sb[i] = int(random.randrange(1,4))
             else:
-                s[0] -= xdelta
+                # the pixel is written directly, rather than calling disp.pixel() for each star
+                o:int = (y >> 3) * 72 + x
+                m:int = 1 << (y & 7)
+                im:int = 255-m
+                b:int = sb[i]
+                if b & 1:
+                    buffer1[o] |= m
+                else:
+                    buffer1[o] &= im
+                if b & 2:
+                    buffer2[o] |= m
+                else:
+                    buffer2[o] &= im
+                sx[i] -= xdelta
+            i += 1
+
 
 
+# min/max arrays for rasterisation (to avoid allocating memory each time)
+# Shapes are only drawn one at a time, so they can all share these. drawrast() leaves
+# them cleared after drawing each face.
+shape_rastmin = array('B', [0xff]*40)
+shape_rastmax = array('B', [0]*40)
+
 
 # A 3D shape.
 # It requires:
@@ -600,15 +725,23 @@ class Shape:
         self.rot_axis = array('l', [0, fpone, 0])
         self.rot_angle:int = 0
         self.pos = array('l', [0,0,0])
-        # transformed 3D coordinates
-        self.pm = [array('l', [0,0,0]) for _ in range(vertcnt + (facecnt if calc_normals else 0))]
-        # and projection mapped 2D coordinates
-        self.p2 = [array('l', [0,0]) for _ in range(vertcnt)]
+        # scratch space for fpsincos()
+        self.sincos = array('l', [0,0])
+        # the rotation matrix, followed by the angle and axis it was calculated for
+        self.mat = array('l', [0] * 9 + [0x7fffffff, 0, 0, 0])
+        # normalised vector from the shape to the light source, see calc_light_dir()
+        self.light_dir = array('l', [0,0,0])
+        # transformed 3D coordinates, stored as x,y,z for each vertex
+        self.pm = array('l', [0] * (3 * (vertcnt + (facecnt if calc_normals else 0))))
+        # and projection mapped 2D coordinates, stored as x,y for each vertex
+        self.p2 = array('l', [0] * (2 * vertcnt))
         # which faces are visible
         self.facevis:List[bool] = [False] * facecnt
-        # min/max arrays for rasterisation (to avoid allocating memory each time)
-        self.rastmin = array('B', [0xff]*40)
-        self.rastmax = array('B', [0]*40)
+        # min/max arrays for rasterisation, shared between all shapes
+        self.rastmin = shape_rastmin
+        self.rastmax = shape_rastmax
+        # the first and last rows covered by the face in the min/max arrays
+        self.rast_range = array('l', [0, -1])
 
         if calc_normals:
             for i in range(facecnt):
@@ -621,6 +754,21 @@ class Shape:
                       int((p0[2]+n[2])*65536))
                 self.vertices[i + vertcnt] = pn
                 self.faces[i] = (f[0], f[1], (p0i, vertcnt + i))
+        # the two normal vertex indices for each face, and each face's shade, so the draw
+        # loop can read them through a pointer rather than unpacking the face tuples
+        self.face_norm_idx = array('H', [n for f in self.faces for n in f[2]])
+        self.face_shade_src = array('H', [f[1] for f in self.faces])
+        # the vertex indices of all the faces, one face after another. Face i's are from
+        # face_vert_start[i] up to face_vert_start[i + 1].
+        self.face_verts = array('H', [v for f in self.faces for v in f[0]])
+        self.face_vert_start = array('H', [0] * (facecnt + 1))
+        for i in range(facecnt):
+            self.face_vert_start[i + 1] = self.face_vert_start[i] + len(self.faces[i][0])
+        # only the vertices used for visibility and shading need their 3D coordinates
+        # kept in pm, the rest are only needed projected into p2
+        self.needs_pm = bytearray(len(self.vertices))
+        for n in self.face_norm_idx:
+            self.needs_pm[n] = 1
 
         # convert vertices to fixed-point
         # we do this after calculating normals so that normals can be calculated with
@@ -629,6 +777,8 @@ class Shape:
             x, y, z = self.vertices[i]
             x *= 65536 ; y *= 65536 ; z *= 65536
             self.vertices[i] = (int(x), int(y), int(z))
+        # then flatten them into x,y,z for each vertex, so they can be read through a pointer
+        self.vertices = array('l', [c for p in self.vertices for c in p])
 
 
     # This function uses the first 3 vertex coordinates to calculate the face normal.
@@ -663,164 +813,199 @@ class Shape:
         self.pos = pos if not pos is None else [0,0,0]
         self.rot_axis = rot_axis if not rot_axis is None else [0, fpone, 0]
         self.rot_angle = rot_angle if not rot_angle is None else 0
+        # every vertex is needed in pm for this
+        needs_pm_save = self.needs_pm
+        self.needs_pm = bytearray(b'\x01' * len(needs_pm_save))
         self.transform_vertices()
-        self.vertices = [(x,y,z) for x,y,z in self.pm]
+        vertices = self.vertices
+        pm = self.pm
+        for i in range(len(vertices)):
+            vertices[i] = pm[i]
 
         self.pos = pos_save
         self.rot_axis = rot_axis_save
         self.rot_angle = rot_angle_save
+        self.needs_pm = needs_pm_save
 
 
-    # Constructs the local transformation matrix and transforms the shape's 3D coordinates
+    # Constructs the local transformation matrix and transforms the shape's 3D coordinates,
+    # projecting them into p2 as it goes
     @micropython.viper
     def transform_vertices(self):
-        px:int; py:int; pz:int
-        px, py, pz = self.pos
-
-        # Convert axis-angle to quaternion, then quaternion to rotation matrix
-        #   https://danceswithcode.net/engineeringnotes/quaternions/quaternions.html
-        ra_d2:int = int(self.rot_angle) >> 1
-        rax:int; ray:int; raz:int
-        rax, ray, raz = self.rot_axis
-        sin_ra_d2:int = fpsin(ra_d2)
-        q0:int = fpcos(ra_d2)
-        q1:int = fpmul_rot(rax, sin_ra_d2)
-        q2:int = fpmul_rot(ray, sin_ra_d2)
-        q3:int = fpmul_rot(raz, sin_ra_d2)
-
-        q1_sq2:int = int(fpmul_rot(q1, q1)) << 1
-        q2_sq2:int = int(fpmul_rot(q2, q2)) << 1
-        q3_sq2:int = int(fpmul_rot(q3, q3)) << 1
-
-        q0_q1_2:int = int(fpmul_rot(q0, q1)) << 1
-        q0_q2_2:int = int(fpmul_rot(q0, q2)) << 1
-        q0_q3_2:int = int(fpmul_rot(q0, q3)) << 1
-        q1_q2_2:int = int(fpmul_rot(q1, q2)) << 1
-        q1_q3_2:int = int(fpmul_rot(q1, q3)) << 1
-        q2_q3_2:int = int(fpmul_rot(q2, q3)) << 1
-
-        rxx:int = fpone - q2_sq2 - q3_sq2
-        rxy:int = q1_q2_2 - q0_q3_2
-        rxz:int = q1_q3_2 + q0_q2_2
-
-        ryx:int = q1_q2_2 + q0_q3_2
-        ryy:int = fpone - q1_sq2 - q3_sq2
-        ryz:int = q2_q3_2 - q0_q1_2
-
-        rzx:int = q1_q3_2 - q0_q2_2
-        rzy:int = q2_q3_2 + q0_q1_2
-        rzz:int = fpone - q1_sq2 - q2_sq2
-
-        pm = self.pm
+        pos = self.pos
+        px:int = int(pos[0]) ; py:int = int(pos[1]) ; pz:int = int(pos[2])
+
+        # The rotation matrix is only recalculated when the rotation has changed
+        mat:ptr32 = ptr32(self.mat)
+        ra:int = int(self.rot_angle)
+        rot_axis = self.rot_axis
+        rax:int = int(rot_axis[0]) ; ray:int = int(rot_axis[1]) ; raz:int = int(rot_axis[2])
+        if ra != mat[9] or rax != mat[10] or ray != mat[11] or raz != mat[12]:
+            # Convert axis-angle to quaternion, then quaternion to rotation matrix
+            #   https://danceswithcode.net/engineeringnotes/quaternions/quaternions.html
+            ra_d2:int = ra >> 1
+            fpsincos(ra_d2, self.sincos)
+            sincos:ptr32 = ptr32(self.sincos)
+            sin_ra_d2:int = sincos[0]
+            q0:int = sincos[1]
+            q1:int = fpmul_rot(rax, sin_ra_d2)
+            q2:int = fpmul_rot(ray, sin_ra_d2)
+            q3:int = fpmul_rot(raz, sin_ra_d2)
+
+            q1_sq2:int = int(fpmul_rot(q1, q1)) << 1
+            q2_sq2:int = int(fpmul_rot(q2, q2)) << 1
+            q3_sq2:int = int(fpmul_rot(q3, q3)) << 1
+
+            q0_q1_2:int = int(fpmul_rot(q0, q1)) << 1
+            q0_q2_2:int = int(fpmul_rot(q0, q2)) << 1
+            q0_q3_2:int = int(fpmul_rot(q0, q3)) << 1
+            q1_q2_2:int = int(fpmul_rot(q1, q2)) << 1
+            q1_q3_2:int = int(fpmul_rot(q1, q3)) << 1
+            q2_q3_2:int = int(fpmul_rot(q2, q3)) << 1
+
+            mat[0] = fpone - q2_sq2 - q3_sq2
+            mat[1] = q1_q2_2 - q0_q3_2
+            mat[2] = q1_q3_2 + q0_q2_2
+
+            mat[3] = q1_q2_2 + q0_q3_2
+            mat[4] = fpone - q1_sq2 - q3_sq2
+            mat[5] = q2_q3_2 - q0_q1_2
+
+            mat[6] = q1_q3_2 - q0_q2_2
+            mat[7] = q2_q3_2 + q0_q1_2
+            mat[8] = fpone - q1_sq2 - q2_sq2
+
+            mat[9] = ra ; mat[10] = rax ; mat[11] = ray ; mat[12] = raz
+
+        rxx:int = mat[0] ; rxy:int = mat[1] ; rxz:int = mat[2]
+        ryx:int = mat[3] ; ryy:int = mat[4] ; ryz:int = mat[5]
+        rzx:int = mat[6] ; rzy:int = mat[7] ; rzz:int = mat[8]
+
+        pm:ptr32 = ptr32(self.pm)
+        p2:ptr32 = ptr32(self.p2)
+        needs_pm:ptr8 = ptr8(self.needs_pm)
 
-        x:int ; y:int ; z:int
         _x:int ; _y:int ; _z:int
         i:int = 0
-        vertices = self.vertices
-        vertlen:int = int(len(vertices))
-        while i < vertlen:
-            p3 = vertices[i]
-            x,y,z = p3
-            _x = fpmul(x, rxx) + fpmul(y, rxy) + fpmul(z, rxz) + px
-            _y = fpmul(x, ryx) + fpmul(y, ryy) + fpmul(z, ryz) + py
-            _z = fpmul(x, rzx) + fpmul(y, rzy) + fpmul(z, rzz) - pz
-            pm[i][0] = _x ; pm[i][1] = _y ; pm[i][2] = _z
+        j:int = 0
+        vertices:ptr32 = ptr32(self.vertices)
+        vertlen:int = int(len(self.vertices))
+        len_p2:int = int(len(self.p2))
+        while j < vertlen:
+            x:int = vertices[j] ; y:int = vertices[j+1] ; z:int = vertices[j+2]
+            _x = int(fpmul(x, rxx)) + int(fpmul(y, rxy)) + int(fpmul(z, rxz)) + px
+            _y = int(fpmul(x, ryx)) + int(fpmul(y, ryy)) + int(fpmul(z, ryz)) + py
+            _z = int(fpmul(x, rzx)) + int(fpmul(y, rzy)) + int(fpmul(z, rzz)) - pz
+            if needs_pm[i]:
+                pm[j] = _x ; pm[j+1] = _y ; pm[j+2] = _z
+            # projection mapping (3D->2D), the same as project_x() and project_y(), but
+            # done inline to save two function calls per vertex. The face normal vertices
+            # at the end don't need projecting.
+            if (i << 1) < len_p2:
+                zd:int = (_z - project_z_fp) >> 6
+                p2[i << 1] = 36 - (((((_x << 6) // zd) >> 4) * project_d) >> 8)
+                p2[(i << 1) + 1] = 20 + (((((_y << 6) // zd) >> 4) * project_d) >> 8)
             i += 1
+            j += 3
 
 
-    # Initialises the min/max arrays and then rasterises each edge.
+    # Rasterises each edge into the min/max arrays, which drawrast() leaves cleared.
     # The final min/max arrays are then able to provide the entire face as a polygon.
-    @micropython.native
-    def rastface(self, f):
+    # The range of rows covered by the face is kept, so drawrast() only needs to look at those.
+    @micropython.viper
+    def rastface(self, i:int):
         rastmin = self.rastmin
         rastmax = self.rastmax
-        i = 0
-        while i < 40:
-            rastmin[i] = 0xff
-            rastmax[i] = 0
-            i += 1
-        vertices = f[0]
-        p2 = self.p2
-        sp = p2[vertices[-1]]
-        for v in vertices:
-            ep = p2[v]
-            rastline(sp[0], sp[1], ep[0], ep[1], rastmin, rastmax)
+        p2:ptr32 = ptr32(self.p2)
+        face_verts:ptr16 = ptr16(self.face_verts)
+        face_vert_start:ptr16 = ptr16(self.face_vert_start)
+        j:int = face_vert_start[i]
+        jend:int = face_vert_start[i + 1]
+        sp:int = face_verts[jend - 1] << 1
+        y0:int = 40 ; y1:int = -1
+        while j < jend:
+            ep:int = face_verts[j] << 1
+            ey:int = p2[ep+1]
+            if ey < y0: y0 = ey
+            if ey > y1: y1 = ey
+            rastline(p2[sp], p2[sp+1], p2[ep], ey, rastmin, rastmax)
             sp = ep
-
-    # Renders a polygon using calculated min/max x-coordinates for each display row
+            j += 1
+        if y0 < 0: y0 = 0
+        if y1 > 39: y1 = 39
+        rast_range:ptr32 = ptr32(self.rast_range)
+        rast_range[0] = y0
+        rast_range[1] = y1
+
+    # Renders a polygon using calculated min/max x-coordinates for each display row,
+    # clearing each row as it goes, ready for the next face
     @micropython.viper
     def drawrast(self, s:int):
-        dith_mat1:ptr32 = ptr32(dither1[s])
-        dith_mat2:ptr32 = ptr32(dither2[s])
+        dith_mat1:ptr32 = ptr32(dither1_flat)
+        dith_mat2:ptr32 = ptr32(dither2_flat)
+        do:int = s << dith_ys
         # It looks better if 0,0 of the dither tile moves with the face, so we don't just
         # use the display x,y coord to map into the dither tile
         dy:int = 0
         dx:int = 65536
         rastmin = ptr8(self.rastmin)
         rastmax = ptr8(self.rastmax)
-        for y in range(40):
+        rast_range:ptr32 = ptr32(self.rast_range)
+        y:int = rast_range[0]
+        y1:int = rast_range[1]
+        while y <= y1:
             mn:int = int(rastmin[y])
             mx:int = int(rastmax[y])
+            rastmin[y] = 0xff
+            rastmax[y] = 0
             if mn < mx:
                 if dx == 65536:
                     dx = mn
-                hline_dither(mn, mx, y, dith_mat1[dy & dith_h_mask], dith_mat2[dy & dith_h_mask], dx)
+                hline_dither(mn, mx, y, dith_mat1[do + (dy & dith_h_mask)], dith_mat2[do + (dy & dith_h_mask)], dx)
                 dy += 1
+            y += 1
 
     # Draw each face, if visible
-    @micropython.native
+    @micropython.viper
     def draw(self):
-        p2 = self.p2
-        pm = self.pm
+        pm:ptr32 = ptr32(self.pm)
         faces = self.faces
 
-        # perform 3D transformations of the vertices
+        # perform 3D transformations and projection mapping of the vertices
         self.transform_vertices()
+        self.calc_light_dir()
 
-        # projection mapping (3D->2D), and face visibility calculations
-        i = 0
-        len_p2 = len(p2)
-        while i < len_p2:
-            _x,_y,_z = pm[i]
-            x = project_x(_x, _z)
-            y = project_y(_y, _z)
-            p2[i][0] = x ; p2[i][1] = y
-            i += 1
-
-        i = 0
-        len_faces = len(faces)
+        # face visibility calculations
+        fni:ptr16 = ptr16(self.face_norm_idx)
+        j:int
+        i:int = 0
+        len_faces:int = int(len(faces))
         while i < len_faces:
             # calculate visibility
-            f = faces[i]
-            fn = f[2]
-            x0,y0,z0 = pm[fn[0]]
-            x1,y1,z1 = pm[fn[1]]
-            k = calc_norm_k(x0,y0,z0,x1,y1,z1)
+            j = fni[i << 1] * 3
+            x0:int = pm[j] ; y0:int = pm[j+1] ; z0:int = pm[j+2]
+            j = fni[(i << 1) + 1] * 3
+            x1:int = pm[j] ; y1:int = pm[j+1] ; z1:int = pm[j+2]
+            k:int = int(calc_norm_k(x0,y0,z0,x1,y1,z1))
             if (k - z0 + z1) > 0:
                 # face is visible, calculate the shade
-                s = self.calc_shade(f)
+                s = self.calc_shade(i)
                 # rasterise the face
-                self.rastface(f)
+                self.rastface(i)
                 # and draw it
                 self.drawrast(s)
             i += 1
 
 
-    # Calculate a face's shade use the dot-product
-    #  https://en.wikipedia.org/wiki/Dot_product
-    # of the face normal and a normalised vector between the light source position and
-    # the first vertex of the face.
+    # The light source is far enough away compared to the size of a shape that the vector
+    # to it from the shape's position can be used for all of its faces. That means it only
+    # has to be normalised once per frame, rather than for every visible face.
     @micropython.viper
-    def calc_shade(self, f) -> int:
-        pm = self.pm
-        xl:int = int(light_pos[0]); yl:int = int(light_pos[1]); zl:int = int(light_pos[2])
-        p0 = pm[f[2][0]]
-        p1 = pm[f[2][1]]
-        x0:int = int(p0[0]); y0:int = int(p0[1]); z0:int = int(p0[2])
-        x1:int = int(p1[0]); y1:int = int(p1[1]); z1:int = int(p1[2])
-
-        vx:int = xl-x0 ; vy:int = yl-y0 ; vz:int = zl-z0
-        wx:int = x1-x0 ; wy:int = y1-y0 ; wz:int = z1-z0
+    def calc_light_dir(self):
+        pos:ptr32 = ptr32(self.pos)
+        vx:int = int(light_pos[0]) - pos[0]
+        vy:int = int(light_pos[1]) - pos[1]
+        vz:int = int(light_pos[2]) + pos[2]
 
         #vx,vy,vz = vect_norm(vx,vy,vz)
         # normalise the vector
@@ -836,11 +1021,25 @@ class Shape:
         m:int = int(isqrt(a)) << 1
         if m == 0:
             m = 2
-        vx = int(fpdiv(vx,m)) <<1
-        vy = int(fpdiv(vy,m)) <<1
-        vz = int(fpdiv(vz,m)) <<1
+        ld:ptr32 = ptr32(self.light_dir)
+        ld[0] = int(fpdiv(vx,m)) <<1
+        ld[1] = int(fpdiv(vy,m)) <<1
+        ld[2] = int(fpdiv(vz,m)) <<1
 
-        fs:int = int(f[1])
+    # Calculate face i's shade use the dot-product
+    #  https://en.wikipedia.org/wiki/Dot_product
+    # of the face normal and the normalised light vector from calc_light_dir().
+    @micropython.viper
+    def calc_shade(self, i:int) -> int:
+        pm:ptr32 = ptr32(self.pm)
+        ld:ptr32 = ptr32(self.light_dir)
+        fni:ptr16 = ptr16(self.face_norm_idx)
+        j0:int = fni[i << 1] * 3
+        j1:int = fni[(i << 1) + 1] * 3
+        wx:int = pm[j1] - pm[j0] ; wy:int = pm[j1+1] - pm[j0+1] ; wz:int = pm[j1+2] - pm[j0+2]
+        vx:int = ld[0] ; vy:int = ld[1] ; vz:int = ld[2]
+
+        fs:int = ptr16(self.face_shade_src)[i]
 
         dp:int = int(fpmul(vx, wx)) + int(fpmul(vy, wy)) + int(fpmul(vz, wz))
         if dp < 0:
@@ -972,7 +1171,7 @@ road_speed = const(3 << 16)
 stars = Stars(40)
 
 from mountains import Mountains
-mountains = Mountains(dither1, dither2, dith_w_mask, dith_h_mask)
+mountains = Mountains(dither1_flat, dither2_flat, dith_w_mask, dith_h_mask)
 
 gc.collect()
 
@@ -996,8 +1195,6 @@ shape_ball.destructive_transform(None, [0, 0, fpone], random.randrange(-70, 70))
 shape_cube.pos[2] = int2fp(2)
 shape_ball.pos[2] = int2fp(2)
 
-shape_lean_ang = 0
-
 # We'll cycle between the two shapes..
 shape_ind_cube = const(0)
 shape_ind_ball = const(1)
@@ -1023,58 +1220,73 @@ ball_decay_being = const(3900)
 ball_decay_entering = const(2510)
 ball_decay_leaving = const(4625)
 ball_decay_go_already = const(5000)
-ball_decay_vals = array('h', [0, 0, ball_decay_leaving, ball_decay_leaving, ball_decay_go_already])
+# indexed by the shape state, and read as unsigned halfwords by move_shape_anim()
+ball_decay_vals = array('H', [0, 0, ball_decay_leaving, ball_decay_leaving, ball_decay_go_already])
 
 # ..with a timeout to know when to start switching.
 shape_leave_t0 = utime.ticks_ms()
 shape_leave_timeout = const(12000)
 
-shape_ind_next = -1
+# The animation state is kept in an array, so move_shape_anim() can work on it as viper ints
+shape_anim_ind = const(0)
+shape_anim_ind_next = const(1)
+shape_anim_state = const(2)
+shape_anim_pos_mod = const(3)
+shape_anim_lean_ang = const(4)
+shape_anim = array('l', [0, -1, shape_state_entering, 0, 0])
+# scratch space for fpsincos() in move_shape_anim()
+shape_anim_sincos = array('l', [0, 0])
+
 # enter stage top
-shape_state = shape_state_entering
 if True:
     shape = shape_cube
-    shape_ind = shape_ind_cube
+    shape_anim[shape_anim_ind] = shape_ind_cube
     shape_cube.pos[1] = cube_y_start
-    shape_pos_mod = cube_mod_init
+    shape_anim[shape_anim_pos_mod] = cube_mod_init
 else:
     shape = shape_ball
-    shape_ind = shape_ind_ball
+    shape_anim[shape_anim_ind] = shape_ind_ball
     shape_ball.pos[1] = ball_y_start
-    shape_pos_mod = 0
+    shape_anim[shape_anim_pos_mod] = 0
 
 
-@micropython.native
-def move_shape():
-    global shape, shape_ind, shape_lean_ang
-    global shape_ind_next
-    global shape_leave_t0, shape_state, shape_pos_mod
-    global ball_decay_vals
+# Moves the shape and steps through the animation, returning the new rotation angle.
+# timed_out is set once the shape has been around for long enough that it should leave.
+@micropython.viper
+def move_shape_anim(pos:ptr32, rot_axis:ptr32, rot_angle:int, timed_out:int, botseg_dx:int) -> int:
+    anim:ptr32 = ptr32(shape_anim)
+    road_state:ptr32 = ptr32(road.state)
+    px:int = pos[0] ; py:int = pos[1] ; pz:int = pos[2]
+    shape_ind:int = anim[shape_anim_ind]
+    shape_state:int = anim[shape_anim_state]
+    shape_pos_mod:int = anim[shape_anim_pos_mod]
+    shape_lean_ang:int = anim[shape_anim_lean_ang]
+    b:int
 
     # as the road curves round, gradually move the shape into the curve
-    shaperoad_delta = shape.pos[0] - (road.botseg_dx * 48)    # 1<<6 * 0.75
+    shaperoad_delta:int = px - (botseg_dx * 48)    # 1<<6 * 0.75
     if shaperoad_delta > 4096:
-        shape.pos[0] -= 4096
+        px -= 4096
     elif shaperoad_delta < -4096:
-        shape.pos[0] += 4096
+        px += 4096
     else:
-        shape.pos[0] -= shaperoad_delta
+        px -= shaperoad_delta
 
     # move the shape nearer to or further from the camera depending on how curved the road is.
     # hopefully this combines with the road speed change to provide a greater sensation of speed
-    ardx = road.botseg_dx
-    if ardx < 0:
-        ardx = -ardx
-    shaperoad_delta = shape.pos[2] - ((2 << 16) - (ardx << 4))
+    # abs() without a branch: the sign mask is either 0 or -1
+    sm:int = botseg_dx >> 31
+    ardx:int = (botseg_dx ^ sm) - sm
+    shaperoad_delta = pz - ((2 << 16) - (ardx << 4))
     if shaperoad_delta > 4096:
-        shape.pos[2] -= 4096
+        pz -= 4096
     elif shaperoad_delta < -4096:
-        shape.pos[2] += 4096
+        pz += 4096
     else:
-        shape.pos[2] -= shaperoad_delta
+        pz -= shaperoad_delta
 
     # the rotation axis is changed depending on the curve of the road
-    lean_ang_delta = road.botseg_dx - shape_lean_ang
+    lean_ang_delta:int = botseg_dx - shape_lean_ang
     if lean_ang_delta > 256:
         shape_lean_ang += 256
     elif lean_ang_delta < -256:
@@ -1085,136 +1297,188 @@ def move_shape():
         shape_lean_ang = 16384
     elif shape_lean_ang < -16384:
         shape_lean_ang = -16384
-    shape_rot_ang_sin = fpsin(shape_lean_ang >> 8)
-    shape_rot_ang_cos = fpcos(shape_lean_ang >> 8)
+    fpsincos(shape_lean_ang >> 8, shape_anim_sincos)
+    sincos:ptr32 = ptr32(shape_anim_sincos)
+    shape_rot_ang_sin:int = sincos[0]
+    shape_rot_ang_cos:int = sincos[1]
     # the rotation axis vector must have length of 1
     # so we calculate the vector as for a point on a sphere with r=1
-    shape.rot_axis[0] = -fpmul_rot(shape_rot_ang_cos, shape_rot_ang_cos)
-    shape.rot_axis[1] = fpmul_rot(shape_rot_ang_cos, shape_rot_ang_sin)
-    shape.rot_axis[2] = -shape_rot_ang_sin
+    rot_axis[0] = 0 - int(fpmul_rot(shape_rot_ang_cos, shape_rot_ang_cos))
+    rot_axis[1] = int(fpmul_rot(shape_rot_ang_cos, shape_rot_ang_sin))
+    rot_axis[2] = 0 - shape_rot_ang_sin
 
-    shape.rot_angle += road_speed >> 14
-    shape.rot_angle &= sintab_mask
+    rot_angle += road_speed >> 14
+    rot_angle &= sintab_mask
 
     # vertical position depends on the shape and the animation stage
     if shape_ind == shape_ind_cube:
         if shape_state == shape_state_being:
-            b = fpsin((shape.rot_angle << 1) + sintab_sz_quart) * 4
-            if b < 0: b = -b
-            shape.pos[1] = (4 << 16) - b
-            if utime.ticks_diff(utime.ticks_ms(), shape_leave_t0) >= shape_leave_timeout:
+            b = int(fpsin((rot_angle << 1) + sintab_sz_quart)) * 4
+            sm = b >> 31 ; b = (b ^ sm) - sm
+            py = (4 << 16) - b
+            if timed_out:
                 shape_state = shape_state_leaving
                 shape_pos_mod = cube_mod_init
         elif shape_state == shape_state_entering:
-            shape.pos[1] -= shape_pos_mod
+            py -= shape_pos_mod
             shape_pos_mod += cube_mod_incr_entering
-            b = fpsin((road.zoff >> 13) + sintab_sz_quart) * 4
-            if b < 0: b = -b
-            if shape.pos[1] <= (4 << 16) - b:
+            b = int(fpsin((road_state[road_zoff] >> 13) + sintab_sz_quart)) * 4
+            sm = b >> 31 ; b = (b ^ sm) - sm
+            if py <= (4 << 16) - b:
                 shape_state = shape_state_being
-                shape_leave_t0 = utime.ticks_ms()
         elif shape_state == shape_state_leaving:
-            shape.pos[1] += shape_pos_mod
-            shape.rot_angle += road_speed >> 15
+            py += shape_pos_mod
+            rot_angle += road_speed >> 15
             shape_pos_mod += cube_mod_incr_leaving
-            if shape.pos[1] >= cube_y_lim:
+            if py >= cube_y_lim:
                 shape_state = shape_state_entering
-                shape_ball.pos[1] = ball_y_start
+                ptr32(shape_ball.pos)[1] = ball_y_start
                 shape_pos_mod = 0
-                shape_ind_next = shape_ind_ball
+                anim[shape_anim_ind_next] = shape_ind_ball
     else:
         if shape_state == shape_state_being:
-            shape.pos[1] += shape_pos_mod
+            py += shape_pos_mod
             shape_pos_mod -= ball_mod_incr
-            if shape.pos[1] <= (-4 << 16):
-                shape_pos_mod = (-shape_pos_mod * ball_decay_being) >> 12
-            if utime.ticks_diff(utime.ticks_ms(), shape_leave_t0) >= shape_leave_timeout:
+            if py <= (-4 << 16):
+                shape_pos_mod = ((0 - shape_pos_mod) * ball_decay_being) >> 12
+            if timed_out:
                 shape_state = shape_state_leaving
         elif shape_state == shape_state_entering:
-            shape.pos[1] += shape_pos_mod
+            py += shape_pos_mod
             shape_pos_mod -= ball_mod_incr
-            if shape.pos[1] <= (-4 << 16):
-                shape_pos_mod = (-shape_pos_mod * ball_decay_entering) >> 12
+            if py <= (-4 << 16):
+                shape_pos_mod = ((0 - shape_pos_mod) * ball_decay_entering) >> 12
                 shape_state = shape_state_being
-                shape_leave_t0 = utime.ticks_ms()
         elif shape_state >= shape_state_leaving:
-            shape.pos[1] += shape_pos_mod
+            py += shape_pos_mod
             shape_pos_mod -= ball_mod_incr
-            if shape.pos[1] <= (-4 << 16):
-                shape_pos_mod = (-shape_pos_mod * ball_decay_vals[shape_state]) >> 12
+            if py <= (-4 << 16):
+                shape_pos_mod = ((0 - shape_pos_mod) * ptr16(ball_decay_vals)[shape_state]) >> 12
                 if shape_state != shape_state_byeeee:
                     shape_state += 1
-            if shape.pos[1] >= ball_y_lim:
+            if py >= ball_y_lim:
                 shape_state = shape_state_entering
-                shape_cube.pos[1] = cube_y_start
+                ptr32(shape_cube.pos)[1] = cube_y_start
                 shape_pos_mod = cube_mod_init
-                shape_ind_next = shape_ind_cube
+                anim[shape_anim_ind_next] = shape_ind_cube
 
+    pos[0] = px ; pos[1] = py ; pos[2] = pz
+    anim[shape_anim_state] = shape_state
+    anim[shape_anim_pos_mod] = shape_pos_mod
+    anim[shape_anim_lean_ang] = shape_lean_ang
+    return rot_angle
+
+
+# The leave timeout is dealt with here, so that the viper code only has to handle ints
+@micropython.native
+def move_shape(botseg_dx):
+    global shape_leave_t0
+
+    shape_state = shape_anim[shape_anim_state]
+    timed_out = 0
+    if shape_state == shape_state_being:
+        if utime.ticks_diff(utime.ticks_ms(), shape_leave_t0) >= shape_leave_timeout:
+            timed_out = 1
+    shape.rot_angle = move_shape_anim(shape.pos, shape.rot_axis, shape.rot_angle, timed_out, botseg_dx)
+    # start timing when the shape has finished entering
+    if shape_state != shape_state_being and shape_anim[shape_anim_state] == shape_state_being:
+        shape_leave_t0 = utime.ticks_ms()
+
+
+
+# The mountains' x position and speed, kept in an array so they can be updated in viper
+mountain_x = const(0)
+mountain_x_speed = const(1)
+mountain_state = array('l', [0, 0])
+
+# If we just adjust the mountain x by the road delta, we come to an
+# abrupt halt when leaving curves.
+# Limiting the acceleration loosens the movement a bit, which looks much better.
+# Returns the x position to draw the mountains at.
+@micropython.viper
+def update_mountain_x(botseg_dx:int) -> int:
+    st:ptr32 = ptr32(mountain_state)
+    speed:int = st[mountain_x_speed]
+    accel:int = speed - botseg_dx
+    if accel > 128:
+        speed -= 128
+    elif accel < -128:
+        speed += 128
+    else:
+        speed -= accel
+    st[mountain_x_speed] = speed
+    st[mountain_x] += speed
+    return st[mountain_x] >> 13
 
 
 @micropython.viper
-def draw_ground():
-    buffer1:ptr32 = ptr32(disp.buffer1)
+def draw_ground(buffer1:ptr32):
+    # Both rows are 18 words long, so they're filled together, three words at a time
+    # to cut down on the loop overhead
+    p:int = int(0xf0f0f0f0)
     o:int = 54
     while o < 72:
-        buffer1[o] = int(0xf0f0f0f0)
-        o += 1
-    while o < 90:
-        buffer1[o] = -1
-        o += 1
+        buffer1[o] = p ; buffer1[o+1] = p ; buffer1[o+2] = p
+        buffer1[o+18] = -1 ; buffer1[o+19] = -1 ; buffer1[o+20] = -1
+        o += 3
 
 
 fade_out = False
-next_tune_pressed = False ; next_tune_cnt = 0
-mute_toggling = False ; mute_toggle_cnt = 0
+# The buttons are debounced by ignoring them until they've been released for this long
+debounce_ms = const(200)
+next_tune_pressed = False ; next_tune_t0 = 0
+mute_toggling = False ; mute_toggle_t0 = 0
 
 @micropython.native
 def handle_input():
     global player, fade_out
-    global next_tune_pressed, next_tune_cnt
-    global mute_toggling, mute_toggle_cnt
+    global next_tune_pressed, next_tune_t0
+    global mute_toggling, mute_toggle_t0
+
+    gpio = mem32[sio_gpio_in]
 
-    if swB.value() == 0:
+    if (gpio & swB_mask) == 0:
         fade_out = True
 
+    now = utime.ticks_ms()
+
     # We need to debounce the A button to avoid switching tune too rapidly
-    if swA.value() == 0:
+    if (gpio & swA_mask) == 0:
         if not next_tune_pressed:
             player.next_tune()
             next_tune_pressed = True
-        next_tune_cnt = 10
+        next_tune_t0 = now
     elif next_tune_pressed:
-        next_tune_cnt -= 1
-        if next_tune_cnt == 0:
+        if utime.ticks_diff(now, next_tune_t0) >= debounce_ms:
             next_tune_pressed = False
 
     # We need to debounce the d-pad to avoid toggling mute too quickly
-    if swL.value() ^ swR.value() | swU.value() ^ swD.value():
+    if ((gpio >> swL_bit) ^ (gpio >> swR_bit) | (gpio >> swU_bit) ^ (gpio >> swD_bit)) & 1:
         if not mute_toggling:
             player.toggle_mute()
             mute_toggling = True
-        mute_toggle_cnt = 10
+        mute_toggle_t0 = now
     elif mute_toggling:
-        mute_toggle_cnt -= 1
-        if mute_toggle_cnt == 0:
+        if utime.ticks_diff(now, mute_toggle_t0) >= debounce_ms:
             mute_toggling = False
 
 
 @micropython.native
 def shape_update():
-    global shape, shape_cube, shape_ball, shape_ind, shape_ind_next
+    global shape, shape_cube, shape_ball
+    shape_ind_next = shape_anim[shape_anim_ind_next]
     if shape_ind_next == shape_ind_cube:
-        shape_ind = shape_ind_cube
+        shape_anim[shape_anim_ind] = shape_ind_cube
         shape = shape_cube
         shape_cube.pos[0] = shape_ball.pos[0]
         shape_cube.pos[2] = shape_ball.pos[2]
-        shape_ind_next = -1
+        shape_anim[shape_anim_ind_next] = -1
     elif shape_ind_next == shape_ind_ball:
-        shape_ind = shape_ind_ball
+        shape_anim[shape_anim_ind] = shape_ind_ball
         shape = shape_ball
         shape_ball.pos[0] = shape_cube.pos[0]
         shape_ball.pos[2] = shape_cube.pos[2]
-        shape_ind_next = -1
+        shape_anim[shape_anim_ind_next] = -1
 
 
 @micropython.native
@@ -1228,47 +1492,50 @@ def main(on_load):
     try:
         fps = -1
         fade_contrast = 255 ; fade_cnt = 3
-        mountain_x_speed = 0 ; mountain_x = 0
 
         player.start()
 
+        # local aliases save looking these up in the utime module every frame
+        # the display buffers don't change, so they can be passed straight to the drawing code
+        buffer1 = disp.buffer1
+        buffer2 = disp.buffer2
+
+        ticks_us = utime.ticks_us
+        ticks_diff = utime.ticks_diff
+        sleep_ms = utime.sleep_ms
+        sleep_us = utime.sleep_us
+
+        # the road's bottom segment x delta, read once each time the road is updated
+        botseg_dx = road.state[road_botseg_dx]
+
         while True:
-            t0 = utime.ticks_us()
+            t0 = ticks_us()
             player.frame()
 
-            # If we just adjust the mountain x by the road delta, we come to an
-            # abrupt halt when leaving curves.
-            # Limiting the acceleration loosens the movement a bit, which looks much better.
-            mountain_x_accel = mountain_x_speed - road.botseg_dx
-            if mountain_x_accel > 128:
-                mountain_x_speed -= 128
-            elif mountain_x_accel < -128:
-                mountain_x_speed += 128
-            else:
-                mountain_x_speed -= mountain_x_accel
-            mountain_x += mountain_x_speed
+            mx = update_mountain_x(botseg_dx)
 
             road.update(road_speed)
+            botseg_dx = road.state[road_botseg_dx]
 
             disp.fill(0)
-            draw_ground()
+            draw_ground(buffer1)
 
             rcx = road.draw()
 
             # We move the star field at a proportional rate to the road speed,
             # and we use an x offset so that the centre of the starfield scrolls laterally as
             # the road curves round.
-            stars.draw_update(rcx, 25, road.botseg_dx << 4, road_speed << 2)
+            stars.draw_update(rcx, 25, botseg_dx << 4, road_speed << 2)
 
-            mountains.draw(disp, mountain_x >> 13)
+            mountains.draw(buffer1, buffer2, mx)
 
-            move_shape()
+            move_shape(botseg_dx)
             shape.draw()
 
             shape_update()
 
-            # uncomment to display FPS
-            #disp.draw_text(str(fps>>4), 0, 0, 2)
+            if show_fps:
+                disp.draw_text(str(fps>>4), 0, 0, 2)
 
             handle_input()
 
@@ -1284,22 +1551,28 @@ def main(on_load):
             disp.show()
 
             # calculate Q28.4 FPS value and low-pass filter it
-            # This can probably be commented out if the FPS isn't being displayed
-            t1 = utime.ticks_us()
-            td = t1 - t0
-            if td == 0:
-                td = 1
-            fpsn = (1000000<<4)//td
-            if fps == -1:
-                fps = fpsn
-            else:
-                fps += (fpsn - fps) >> 5
+            if show_fps:
+                t1 = ticks_us()
+                td = t1 - t0
+                if td == 0:
+                    td = 1
+                fpsn = (1000000<<4)//td
+                if fps == -1:
+                    fps = fpsn
+                else:
+                    fps += (fpsn - fps) >> 5
 
             #mem_info()
 
             # enforce frame rate
-            utime.sleep_ms((frame_microsec - utime.ticks_diff(utime.ticks_us(), t0)) >> 10)
-            utime.sleep_us(frame_microsec - utime.ticks_diff(utime.ticks_us(), t0) - 12)
+            # Whole milliseconds are slept first, leaving the last one to the more accurate
+            # sleep_us(). If the frame took too long, we don't sleep at all.
+            remaining = frame_microsec - ticks_diff(ticks_us(), t0)
+            if remaining > 2000:
+                sleep_ms((remaining // 1000) - 1)
+                remaining = frame_microsec - ticks_diff(ticks_us(), t0)
+            if remaining > 12:
+                sleep_us(remaining - 12)
 
             # end of loop
 
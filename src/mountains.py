@@ -18,9 +18,40 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-import random
+import os
 from array import array
 
+# Mountains.slices holds the bytes for each row of the mountain columns, already shifted
+# into place. There are 256 bytes for each slot: the three rows of the middle part, the
+# two rows of the lower curved ends, and nothing at all, for the row the ends don't use.
+# The slots for plane 1 come first, then plane 2, then the masks of what's kept from
+# the display.
+ms_mid_0 = const(0) ; ms_mid_1 = const(1) ; ms_mid_2 = const(2)
+ms_end_1 = const(3) ; ms_end_2 = const(4) ; ms_none = const(5)
+ms_plane2 = const(6 * 256)
+ms_mask = const(12 * 256)
+
+# Bytes in each 8-pixel display row, and the offset of the first row the mountains
+# are drawn on. The mountain range is 256 columns wide, so x wraps with mount_w_mask.
+disp_w = const(72)
+mount_top = const(72)
+mount_w_mask = const(0xff)
+
+# Mountains.mountbuff holds the plane 1 bits, plane 2 bits and mask for each column, one
+# after the other, so everything for a column is read from the same place
+mb_stride = const(3)
+
+# The curved versions below draw the columns before mount_curve_l and from mount_curve_r
+# onwards one pixel lower than the middle
+mount_curve_l = const(12)
+mount_curve_r = const(61)
+
+# The slot for each of the three rows of each display column, for the curved version below
+mount_col_slots = bytearray(([ms_none, ms_end_1, ms_end_2] * mount_curve_l) +
+                            ([ms_mid_0, ms_mid_1, ms_mid_2] * (mount_curve_r - mount_curve_l)) +
+                            ([ms_none, ms_end_1, ms_end_2] * (disp_w - mount_curve_r)))
+
+
 # we can take advantage of the framebuffer layout to draw the mountain range quickly
 
 # I've provided three different options as I really couldn't make my mind up as to
@@ -29,65 +60,75 @@ from array import array
 # Flat horizon
 '''
 @micropython.viper
-def draw_mountain_range(disp, x0:int, mountbuff1:ptr32, mountbuff2:ptr32, mountmask:ptr32):
-    buffer1:ptr8 = ptr8(disp.buffer1)
-    buffer2:ptr8 = ptr8(disp.buffer2)
-    x:int = 72
-    x0 &= 0xff
-    while x < 144:
-        v1:int = mountbuff1[x0]
-        v2:int = mountbuff2[x0]
-        m:int = mountmask[x0]
-        buffer1[      x] = (buffer1[      x] & ((m << 6) | 0x3f)) | (v1 <<  6)
-        buffer1[ 72 + x] = (buffer1[ 72 + x] & (m >>  6)) | (v1 >>  6)
-        buffer1[144 + x] = (buffer1[144 + x] & (m >> 13)) | (v1 >> 13)
-        buffer2[      x] = (buffer2[      x] & ((m << 6) | 0x3f)) | (v2 <<  6)
-        buffer2[ 72 + x] = (buffer2[ 72 + x] & (m >>  6)) | (v2 >>  6)
-        buffer2[144 + x] = (buffer2[144 + x] & (m >> 13)) | (v2 >> 13)
+def draw_mountain_range(buf1, buf2, x0:int, mnt):
+    mountbuff:ptr32 = ptr32(mnt.mountbuff)
+    buffer1:ptr8 = ptr8(buf1)
+    buffer2:ptr8 = ptr8(buf2)
+    x:int = mount_top
+    x0 &= mount_w_mask
+    while x < mount_top + disp_w:
+        # the offsets of the two rows below, shared by both planes
+        x1:int = x + disp_w
+        x2:int = x1 + disp_w
+        mb:int = x0 * mb_stride
+        v1:int = mountbuff[mb]
+        v2:int = mountbuff[mb + 1]
+        m:int = mountbuff[mb + 2]
+        buffer1[x ] = (buffer1[x ] & ((m << 6) | 0x3f)) | (v1 <<  6)
+        buffer1[x1] = (buffer1[x1] & (m >>  6)) | (v1 >>  6)
+        buffer1[x2] = (buffer1[x2] & (m >> 13)) | (v1 >> 13)
+        buffer2[x ] = (buffer2[x ] & ((m << 6) | 0x3f)) | (v2 <<  6)
+        buffer2[x1] = (buffer2[x1] & (m >>  6)) | (v2 >>  6)
+        buffer2[x2] = (buffer2[x2] & (m >> 13)) | (v2 >> 13)
         x += 1
-        x0 = (x0 + 1) & 0xff
+        x0 = (x0 + 1) & mount_w_mask
 '''
 
 #'''
 # Create a slight curve by painting the left and right of the mountains one pixel down
+# The shifting is done when the slices are made, and the columns are looked up in
+# mount_col_slots, so one loop covers the whole width. Four columns are done at a time,
+# so each row of each plane is a single word read and write, with the leftmost column
+# in the low byte.
 @micropython.viper
-def draw_mountain_range(disp, x0:int, mountbuff1:ptr32, mountbuff2:ptr32, mountmask:ptr32):
-    buffer1:ptr8 = ptr8(disp.buffer1)
-    buffer2:ptr8 = ptr8(disp.buffer2)
-    x:int = 72
-    x0 &= 0xff
-    while x < 84:
-        v1:int = mountbuff1[x0]
-        v2:int = mountbuff2[x0]
-        m:int = mountmask[x0]
-        buffer1[ 72 + x] = (buffer1[ 72 + x] & (m >>  5)) | (v1 >>  5)
-        buffer1[144 + x] = (buffer1[144 + x] & (m >> 12)) | (v1 >> 12)
-        buffer2[ 72 + x] = (buffer2[ 72 + x] & (m >>  5)) | (v2 >>  5)
-        buffer2[144 + x] = (buffer2[144 + x] & (m >> 12)) | (v2 >> 12)
-        x += 1
-        x0 = (x0 + 1) & 0xff
-    while x < 133:
-        v1:int = mountbuff1[x0]
-        v2:int = mountbuff2[x0]
-        m:int = mountmask[x0]
-        buffer1[      x] = (buffer1[      x] & ((m << 6) | 0x3f)) | (v1 <<  6)
-        buffer1[ 72 + x] = (buffer1[ 72 + x] & (m >>  6)) | (v1 >>  6)
-        buffer1[144 + x] = (buffer1[144 + x] & (m >> 13)) | (v1 >> 13)
-        buffer2[      x] = (buffer2[      x] & ((m << 6) | 0x3f)) | (v2 <<  6)
-        buffer2[ 72 + x] = (buffer2[ 72 + x] & (m >>  6)) | (v2 >>  6)
-        buffer2[144 + x] = (buffer2[144 + x] & (m >> 13)) | (v2 >> 13)
-        x += 1
-        x0 = (x0 + 1) & 0xff
-    while x < 144:
-        v1:int = mountbuff1[x0]
-        v2:int = mountbuff2[x0]
-        m:int = mountmask[x0]
-        buffer1[ 72 + x] = (buffer1[ 72 + x] & (m >>  5)) | (v1 >>  5)
-        buffer1[144 + x] = (buffer1[144 + x] & (m >> 12)) | (v1 >> 12)
-        buffer2[ 72 + x] = (buffer2[ 72 + x] & (m >>  5)) | (v2 >>  5)
-        buffer2[144 + x] = (buffer2[144 + x] & (m >> 12)) | (v2 >> 12)
-        x += 1
-        x0 = (x0 + 1) & 0xff
+def draw_mountain_range(buf1, buf2, x0:int, mnt):
+    sl:ptr8 = ptr8(mnt.slices)
+    slots:ptr8 = ptr8(mount_col_slots)
+    buffer1:ptr32 = ptr32(buf1)
+    buffer2:ptr32 = ptr32(buf2)
+    x0 &= mount_w_mask
+    t:int = 0
+    # o and ro count in words
+    o:int = mount_top >> 2
+    while o < (mount_top + disp_w) >> 2:
+        x1:int = (x0 + 1) & mount_w_mask
+        x2:int = (x0 + 2) & mount_w_mask
+        x3:int = (x0 + 3) & mount_w_mask
+        ro:int = o
+        re:int = o + ((3 * disp_w) >> 2)
+        while ro < re:
+            a:int = (slots[t] << 8) + x0
+            b:int = (slots[t + 3] << 8) + x1
+            c:int = (slots[t + 6] << 8) + x2
+            d:int = (slots[t + 9] << 8) + x3
+            mk:int = (sl[ms_mask + a] | (sl[ms_mask + b] << 8) |
+                      (sl[ms_mask + c] << 16) | (sl[ms_mask + d] << 24))
+            # The slices only have bits set where the mask is clear, so if the mask
+            # keeps everything, there's nothing to draw. This is common above the peaks.
+            # The opposite case, a mask that keeps nothing, isn't worth a test: the top
+            # row keeps the sky above the 17 mountain rows, the bottom row keeps the
+            # ground below the horizon, and only the tips of the tallest peaks reach the
+            # top of the middle row.
+            if mk != -1:
+                buffer1[ro] = ((buffer1[ro] & mk) | sl[a] | (sl[b] << 8) |
+                               (sl[c] << 16) | (sl[d] << 24))
+                buffer2[ro] = ((buffer2[ro] & mk) | sl[ms_plane2 + a] | (sl[ms_plane2 + b] << 8) |
+                               (sl[ms_plane2 + c] << 16) | (sl[ms_plane2 + d] << 24))
+            t += 1
+            ro += disp_w >> 2
+        t += 9
+        o += 1
+        x0 = (x0 + 4) & mount_w_mask
 #'''
 
 
@@ -95,44 +136,209 @@ def draw_mountain_range(disp, x0:int, mountbuff1:ptr32, mountbuff2:ptr32, mountm
 # Another curved method, but this shrinks the centre part to create a fisheye effect.
 # we'll draw the part of the ground that is on the bottom 'byte row' we draw on
 @micropython.viper
-def draw_mountain_range(disp, x0:int, mountbuff1:ptr32, mountbuff2:ptr32, mountmask:ptr32):
-    buffer1:ptr8 = ptr8(disp.buffer1)
-    buffer2:ptr8 = ptr8(disp.buffer2)
-    x:int = 72
-    x0 &= 0xff
-    while x < 84:
-        v1:int = mountbuff1[x0]
-        v2:int = mountbuff2[x0]
-        m:int = mountmask[x0]
-        buffer1[ 72 + x] = (buffer1[ 72 + x] & (m >>  5)) | (v1 >>  5)
-        buffer1[144 + x] = (buffer1[144 + x] & (m >> 12)) | (v1 >> 12)
-        buffer2[ 72 + x] = (buffer2[ 72 + x] & (m >>  5)) | (v2 >>  5)
-        buffer2[144 + x] = (buffer2[144 + x] & (m >> 12)) | (v2 >> 12)
+def draw_mountain_range(buf1, buf2, x0:int, mnt):
+    mountbuff:ptr32 = ptr32(mnt.mountbuff)
+    buffer1:ptr8 = ptr8(buf1)
+    buffer2:ptr8 = ptr8(buf2)
+    x:int = mount_top
+    x0 &= mount_w_mask
+    while x < mount_top + mount_curve_l:
+        x1:int = x + disp_w
+        x2:int = x1 + disp_w
+        mb:int = x0 * mb_stride
+        v1:int = mountbuff[mb]
+        v2:int = mountbuff[mb + 1]
+        m:int = mountbuff[mb + 2]
+        buffer1[x1] = (buffer1[x1] & (m >>  5)) | (v1 >>  5)
+        buffer1[x2] = (buffer1[x2] & (m >> 12)) | (v1 >> 12)
+        buffer2[x1] = (buffer2[x1] & (m >>  5)) | (v2 >>  5)
+        buffer2[x2] = (buffer2[x2] & (m >> 12)) | (v2 >> 12)
         x += 1
-        x0 = (x0 + 1) & 0xff
-    while x < 133:
-        v1:int = mountbuff1[x0]
-        v2:int = mountbuff2[x0]
-        m:int = mountmask[x0]
-        buffer1[ 72 + x] = (buffer1[ 72 + x] & (m >>  4)) | (v1 >>  4)
-        buffer1[144 + x] = (buffer1[144 + x] & (m >> 13)) | (v1 >> 13)
-        buffer2[ 72 + x] = (buffer2[ 72 + x] & (m >>  4)) | (v2 >>  4)
-        buffer2[144 + x] = (buffer2[144 + x] & (m >> 13)) | (v2 >> 13)
+        x0 = (x0 + 1) & mount_w_mask
+    while x < mount_top + mount_curve_r:
+        x1:int = x + disp_w
+        x2:int = x1 + disp_w
+        mb:int = x0 * mb_stride
+        v1:int = mountbuff[mb]
+        v2:int = mountbuff[mb + 1]
+        m:int = mountbuff[mb + 2]
+        buffer1[x1] = (buffer1[x1] & (m >>  4)) | (v1 >>  4)
+        buffer1[x2] = (buffer1[x2] & (m >> 13)) | (v1 >> 13)
+        buffer2[x1] = (buffer2[x1] & (m >>  4)) | (v2 >>  4)
+        buffer2[x2] = (buffer2[x2] & (m >> 13)) | (v2 >> 13)
         x += 1
-        x0 = (x0 + 1) & 0xff
-    while x < 144:
-        v1:int = mountbuff1[x0]
-        v2:int = mountbuff2[x0]
-        m:int = mountmask[x0]
-        buffer1[ 72 + x] = (buffer1[ 72 + x] & (m >>  5)) | (v1 >>  5)
-        buffer1[144 + x] = (buffer1[144 + x] & (m >> 12)) | (v1 >> 12)
-        buffer2[ 72 + x] = (buffer2[ 72 + x] & (m >>  5)) | (v2 >>  5)
-        buffer2[144 + x] = (buffer2[144 + x] & (m >> 12)) | (v2 >> 12)
+        x0 = (x0 + 1) & mount_w_mask
+    while x < mount_top + disp_w:
+        x1:int = x + disp_w
+        x2:int = x1 + disp_w
+        mb:int = x0 * mb_stride
+        v1:int = mountbuff[mb]
+        v2:int = mountbuff[mb + 1]
+        m:int = mountbuff[mb + 2]
+        buffer1[x1] = (buffer1[x1] & (m >>  5)) | (v1 >>  5)
+        buffer1[x2] = (buffer1[x2] & (m >> 12)) | (v1 >> 12)
+        buffer2[x1] = (buffer2[x1] & (m >>  5)) | (v2 >>  5)
+        buffer2[x2] = (buffer2[x2] & (m >> 12)) | (v2 >> 12)
         x += 1
-        x0 = (x0 + 1) & 0xff
+        x0 = (x0 + 1) & mount_w_mask
 '''
 
 
+# this function creates a bitmap column in Mountains.mountbuff using a dither tile. kb is
+# the index of the tile's first column mask for the shade and vertical alignment, see
+# colmask. The arrays are passed in by fill_edge(), which looks them up once per edge.
+@micropython.viper
+def fill_col(mountbuff:ptr32, colmask:ptr32, dith_w_mask:int, sx:int, x:int, y:int, kb:int, s:int):
+    mx:int = ((sx + x) & 0xff) * mb_stride
+    k:int = (kb + (x & dith_w_mask)) << 1
+    # the rows from y down to the bottom of the column
+    ym:int = (-1 << y) & 0x1ffff
+    # b ^ ((b ^ c) & ym) takes the bits of c where ym is set, and of b elsewhere
+    b:int = mountbuff[mx]
+    mountbuff[mx] = b ^ ((b ^ colmask[k]) & ym)
+    b = mountbuff[mx + 1]
+    mountbuff[mx + 1] = b ^ ((b ^ colmask[k + 1]) & ym)
+    mountbuff[mx + 2] &= ym ^ -1
+    # Draw a solid or dotted line on the mountain boundary, depending
+    # on whether we're drawing the left or right.
+    # This, along with the shading choices, (hopefully) makes the mountain range
+    # look like it's lit from the right, which matches the lighting
+    # used for the spinning cube.
+    om:int = 1 << y
+    if s == 1:
+        if True:
+            mountbuff[mx] &= om ^ -1
+            mountbuff[mx + 1] |= om
+        else:
+            mountbuff[mx] |= om
+            mountbuff[mx + 1] &= om ^ -1
+        mountbuff[mx + 2] &= om ^ -1
+    elif s == 0 and x & 1:
+        mountbuff[mx] |= om
+        mountbuff[mx + 1] &= om ^ -1
+        mountbuff[mx + 2] &= om ^ -1
+    #mountbuff[mx] |= 1 << 16 ; mountbuff[mx + 1] |= 1 << 16     # useful during dev
+
+
+# Shifts the mountain columns into the bytes for each slot of Mountains.slices
+@micropython.viper
+def make_slices(slc:ptr8, mountbuff:ptr32):
+    i:int = 0
+    mb:int = 0
+    while i < 256:
+        # plane 1, then plane 2
+        o:int = i
+        v:int = mountbuff[mb]
+        while o < (ms_plane2 << 1):
+            slc[(ms_mid_0 << 8) + o] = (v << 6) & 0xff
+            slc[(ms_mid_1 << 8) + o] = (v >> 6) & 0xff
+            slc[(ms_mid_2 << 8) + o] = (v >> 13) & 0xff
+            slc[(ms_end_1 << 8) + o] = (v >> 5) & 0xff
+            slc[(ms_end_2 << 8) + o] = (v >> 12) & 0xff
+            o += ms_plane2
+            v = mountbuff[mb + 1]
+        m:int = mountbuff[mb + 2]
+        o = ms_mask + i
+        slc[(ms_mid_0 << 8) + o] = ((m << 6) | 0x3f) & 0xff
+        slc[(ms_mid_1 << 8) + o] = (m >> 6) & 0xff
+        slc[(ms_mid_2 << 8) + o] = (m >> 13) & 0xff
+        slc[(ms_end_1 << 8) + o] = (m >> 5) & 0xff
+        slc[(ms_end_2 << 8) + o] = (m >> 12) & 0xff
+        slc[(ms_none << 8) + o] = 0xff
+        i += 1
+        mb += mb_stride
+
+
+# Builds the column masks in Mountains.colmask for one plane from its flat dither tiles.
+# The tiles repeat every dith_h rows, so the bits of each tile column are gathered once,
+# repeated down past the bottom of the mountain column, and then every vertical alignment
+# is just that pattern shifted along.
+@micropython.viper
+def make_colmasks(colmask:ptr32, dith:ptr32, shades:int, dith_w_mask:int, dith_h_mask:int, plane:int):
+    dith_h:int = dith_h_mask + 1
+    t:int = 0
+    ib:int = plane
+    tend:int = shades * dith_h
+    while t < tend:
+        lane:int = 0
+        while lane <= dith_w_mask:
+            r:int = 0
+            py:int = 0
+            while py < dith_h:
+                r |= ((dith[t + py] >> lane) & 1) << py
+                py += 1
+            n:int = dith_h
+            while n < 17 + dith_h:
+                r |= r << n
+                n <<= 1
+            # bit py of the column for alignment dy is tile row (py - dy) & dith_h_mask
+            i:int = ib + (lane << 1)
+            dy:int = 0
+            while dy < dith_h:
+                colmask[i] = (r >> (dith_h - dy)) & 0x1ffff
+                i += (dith_w_mask + 1) << 1
+                dy += 1
+            lane += 1
+        ib += dith_h * ((dith_w_mask + 1) << 1)
+        t += dith_h
+
+
+# Fills the columns under one edge of a mountain, w pixels wide and h high, starting at
+# column x0. The edge goes up from the bottom if ydir is negative, otherwise down from the
+# top. The rounding is done with integers, stepping an error term rather than dividing.
+# Each step along the longer side moves less than a whole pixel along the shorter one,
+# so the error term never needs more than one correction per step.
+@micropython.viper
+def fill_edge(m, sx:int, x0:int, w:int, h:int, ydir:int, ds:int, s:int):
+    dy:int = 16 - h
+    # the column masks for the shade and alignment are the same for the whole edge
+    dith_h_mask:int = int(m.dith_h_mask)
+    dith_w_mask:int = int(m.dith_w_mask)
+    kb:int = ((ds * (dith_h_mask + 1)) + (dy & dith_h_mask)) * (dith_w_mask + 1)
+    mountbuff = m.mountbuff
+    colmask = m.colmask
+    y0:int = 16 if ydir < 0 else dy
+    x:int ; y:int
+    # err is twice the fractional part of the offset, plus the half for rounding
+    err:int
+    o:int = 0
+    # depending on the line slope, we either can just map
+    # y -> x, or we want to iterate on y to make sure
+    # we get the 'highest' (actually lowest) y value for each x.
+    w2:int = w << 1
+    h2:int = h << 1
+    if w >= h:
+        err = w
+        x = 0
+        while x < w:
+            fill_col(mountbuff, colmask, dith_w_mask, sx, x0 + x, y0 + (o if ydir > 0 else 0 - o), kb, s)
+            err += h2
+            if err >= w2:
+                err -= w2
+                o += 1
+            x += 1
+    else:
+        err = h
+        lx:int = x0
+        my:int = 16
+        _y:int = 0
+        while _y < h:
+            x = x0 + o
+            y = y0 + (_y if ydir > 0 else 0 - _y)
+            if x != lx:
+                fill_col(mountbuff, colmask, dith_w_mask, sx, lx, my, kb, s)
+                my = 16
+            lx = x
+            if y < my:
+                my = y
+            err += w2
+            if err >= h2:
+                err -= h2
+                o += 1
+            _y += 1
+        fill_col(mountbuff, colmask, dith_w_mask, sx, lx, my, kb, s)
+
+
 # This was the final addition. I started with a version that just drew lines,
 # but realised that it didn't fit stylistically with the rest of the scene.
 # Using the dither tiles provided a better look.
@@ -142,135 +348,61 @@ class Mountains:
         self.dith_w_mask = dith_w_mask
         self.dith_h_mask = dith_h_mask
 
-        # create a dotted line as the horizon base
-        self.mountbuff1 = array('L', [1 << 16, 0, 0, 0] * 64)
-        self.mountbuff2 = array('L', [0 << 16, 0, 0, 0] * 64)
-        self.mountmask = array('L', [~(1 << 16), ~0, ~0, ~0] * 64)
+        # Each column of a dither tile, repeated down a 17 pixel mountain column, for every
+        # shade and vertical tile alignment. These are indexed by
+        # ((shade * dith_h) + (dy & dith_h_mask)) * dith_w + (x & dith_w_mask)
+        # so fill_col() can copy a whole column with a mask, rather than a pixel at a time.
+        # The masks for the two planes are interleaved, as they're always used together.
+        # dither1 and dither2 are the tiles for all the shades, one after the other.
+        shades = len(dither1) // (dith_h_mask + 1)
+        colcnt = shades * (dith_h_mask + 1) * (dith_w_mask + 1)
+        self.colmask = array('L', [0] * (colcnt * 2))
+        make_colmasks(self.colmask, dither1, shades, dith_w_mask, dith_h_mask, 0)
+        make_colmasks(self.colmask, dither2, shades, dith_w_mask, dith_h_mask, 1)
 
-        for i in range(40):
-            sx = random.randrange(256)
-            wl = random.randrange(4, 12)
-            wr = wl + random.randrange(-3, 4)
-            h = random.randrange(wl - 4, wl + 2)
+        # create a dotted line as the horizon base. Each column is plane 1, plane 2, mask.
+        # Bit 16 is also the bottom row of the mountains, which fill_col() paints over,
+        # so the line has to be seeded here rather than added when drawing. It's baked
+        # into the slices along with everything else, so it costs nothing per frame.
+        self.mountbuff = array('L', [1 << 16, 0 << 16, ~(1 << 16),
+                                     0, 0, ~0,  0, 0, ~0,  0, 0, ~0] * 64)
+
+        # All the random numbers for the mountains are fetched in one go, six bytes each,
+        # rather than with a randrange call for every one. The ranges that aren't a power
+        # of two come out very slightly uneven, which doesn't matter for scenery.
+        rnd = os.urandom(40 * 6)
+        # a local alias saves a global lookup for each of the 120 edges
+        _fill_edge = fill_edge
+        for i in range(0, 40 * 6, 6):
+            sx = rnd[i]
+            wl = 4 + (rnd[i+1] & 7)
+            wr = wl - 3 + (rnd[i+2] % 7)
+            h = wl - 4 + (rnd[i+3] % 6)
             if h <  4: h = 4
             if h > 10: h = 10
 
             # Choose darker shading for the left
-            sr = random.randrange(7, 10)
-            sl = random.randrange(4, 7)
-
-            dithr1 = dither1[sr]
-            dithr2 = dither2[sr]
-            dithl1 = dither1[sl]
-            dithl2 = dither2[sl]
-
-            dy = 16 - h
-
-            # depending on the line slope, we either can just map
-            # y -> x, or we want to iterate on y to make sure
-            # we get the 'highest' (actually lowest) y value for each x.
-            if wl >= h:
-                scl = h / wl
-                for x in range(wl):
-                    y = 16 - int(x * scl + 0.5)
-                    self._fill_col(sx, x, y, dy, dithl1, dithl2, 0)
-            else:
-                scl = wl / h
-                lx = 0
-                my = 16
-                for _y in range(h):
-                    x = int(_y * scl + 0.5)
-                    y = 16 - _y
-                    if x != lx:
-                        self._fill_col(sx, lx, my, dy, dithl1, dithl2, 0)
-                        my = 16
-                    lx = x
-                    if y < my:
-                        my = y
-                self._fill_col(sx, lx, my, dy, dithl1, dithl2, 0)
+            sr = 7 + (rnd[i+4] % 3)
+            sl = 4 + (rnd[i+5] % 3)
+
+            _fill_edge(self, sx, 0, wl, h, -1, sl, 0)
 
             # draw a bit of the lighter shade on the left
             wlp = wl // 4
             if wlp < 2: wlp = 2
             psx = sx + (wl - wlp)
-            if wlp >= h:
-                scl = h / wlp
-                for x in range(wlp):
-                    y = 16 - int(x * scl + 0.5)
-                    self._fill_col(psx, x, y, dy, dithr1, dithr2, 2)
-            else:
-                scl = wlp / h
-                lx = 0
-                my = 16
-                for _y in range(h):
-                    x = int(_y * scl + 0.5)
-                    y = 16 - _y
-                    if x != lx:
-                        self._fill_col(psx, lx, my, dy, dithr1, dithr2, 2)
-                        my = 16
-                    lx = x
-                    if y < my:
-                        my = y
-                self._fill_col(psx, lx, my, dy, dithr1, dithr2, 2)
-
-            if wr >= h:
-                scl = h / wr
-                for x in range(wr):
-                    y = dy + int(x * scl + 0.5)
-                    self._fill_col(sx, wl + x, y, dy, dithr1, dithr2, 1)
-            else:
-                scl = wr / h
-                lx = wl
-                my = 16
-                for _y in range(h):
-                    x = wl + int(_y * scl + 0.5)
-                    y = dy + _y
-                    if x != lx:
-                        self._fill_col(sx, lx, my, dy, dithr1, dithr2, 1)
-                        my = 16
-                    lx = x
-                    if y < my:
-                        my = y
-                self._fill_col(sx, lx, my, dy, dithr1, dithr2, 1)
-
-
-    # this function creates a bitmap column using a dither tile
-    def _fill_col(self, sx, x, y, dy, dith1, dith2, s):
-        mx = (sx + x) & 0xff
-        dmx = 1 << (x & self.dith_w_mask)
-        m = 1 << y
-        om = m
-        for py in range(y, 17):
-            dx = (py - dy) & self.dith_h_mask
-            if dith1[dx] & dmx:
-                self.mountbuff1[mx] |= m
-            else:
-                self.mountbuff1[mx] &= ~m
-            if dith2[dx] & dmx:
-                self.mountbuff2[mx] |= m
-            else:
-                self.mountbuff2[mx] &= ~m
-            self.mountmask[mx] &= ~m
-            m <<= 1
-        # Draw a solid or dotted line on the mountain boundary, depending
-        # on whether we're drawing the left or right.
-        # This, along with the shading choices, (hopefully) makes the mountain range
-        # look like it's lit from the right, which matches the lighting
-        # used for the spinning cube.
-        if s == 1:
-            if True:
-                self.mountbuff1[mx] &= ~om
-                self.mountbuff2[mx] |= om
-            else:
-                self.mountbuff1[mx] |= om
-                self.mountbuff2[mx] &= ~om
-            self.mountmask[mx] &= ~om
-        elif s == 0 and x & 1:
-            self.mountbuff1[mx] |= om
-            self.mountbuff2[mx] &= ~om
-            self.mountmask[mx] &= ~om
-        #self.mountbuff1[mx] |= 1 << 16 ; self.mountbuff2[mx] |= 1 << 16     # useful during dev
-
-
-    def draw(self, disp, x0:int):
-        draw_mountain_range(disp, x0, self.mountbuff1, self.mountbuff2, self.mountmask)
+            _fill_edge(self, psx, 0, wlp, h, -1, sr, 2)
+
+            _fill_edge(self, sx, wl, wr, h, 1, sr, 1)
+
+        # The mountains don't change after this, so the bytes written to the display
+        # can all be shifted into place now, rather than every frame
+        self.slices = bytearray(18 * 256)
+        make_slices(self.slices, self.mountbuff)
+        # The column masks are only needed to build the mountains, so give their 2kB back
+        del self.colmask
+
+
+    # buf1 and buf2 are the display's buffer1 and buffer2
+    def draw(self, buf1, buf2, x0:int):
+        draw_mountain_range(buf1, buf2, x0, self)
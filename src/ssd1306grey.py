@@ -96,11 +96,17 @@ class SSD1306_SPI_Grey:
         self.max_y = 40 - 1
         self.pages = self.height // 8
         self.buffer_size = self.pages * self.width
-        self.buffer1 = bytearray(self.buffer_size)
-        self.buffer2 = bytearray(self.buffer_size)
-        self._buffer1 = bytearray(self.buffer_size)
-        self._buffer2 = bytearray(self.buffer_size)
-        self._buffer3 = bytearray(self.buffer_size)
+        # The five buffers are views into a single allocation, so they sit side by side in memory
+        # rather than being scattered around the heap. The buffer size is a multiple of 4, so each
+        # one stays word aligned for the ptr32 accesses.
+        bs = self.buffer_size
+        self._buffers = bytearray(5 * bs)
+        mv = memoryview(self._buffers)
+        self.buffer1 = mv[0:bs]
+        self.buffer2 = mv[bs:2*bs]
+        self._buffer1 = mv[2*bs:3*bs]
+        self._buffer2 = mv[3*bs:4*bs]
+        self._buffer3 = mv[4*bs:5*bs]
 
         # The method used to create reduced flicker greyscale using the SSD1306 uses certain
         # assumptions about the internal behaviour of the controller. Even though the behaviour
@@ -128,7 +134,7 @@ class SSD1306_SPI_Grey:
         # We enhance the greys by modulating the contrast
         if True:
             # brightest
-            self.post_frame_adj = [bytearray([0x81,0x3]), bytearray([0x81,0x7f]), bytearray([0x81,0xff])]
+            adj = (0x3, 0x7f, 0xff)
         else:
             # use setting from thumby.cfg
             brightnessSetting=2
@@ -143,17 +149,31 @@ class SSD1306_SPI_Grey:
             #print(brightnessSetting)
             brightnessVals = [0,112,255]
             brightnessVal = brightnessVals[brightnessSetting]
-            self.post_frame_adj = [bytearray([0x81,brightnessVal>>6]), bytearray([0x81,brightnessVal>>1]), bytearray([0x81,brightnessVal])]
+            adj = (brightnessVal>>6, brightnessVal>>1, brightnessVal)
+
+        # After the delay following each sub-frame, the post frame commands are immediately followed
+        # by that sub-frame's contrast adjustment, so they're kept together, six bytes per sub-frame,
+        # and sent as one transfer. The contrast adjustment at offset 4 is also what's sent straight
+        # after the sub-frame's pixel data. The display thread reads the contrast levels straight out of
+        # the sequence, so a contrast change is just three byte writes, with nothing allocated.
+        self.post_frame_seq = bytearray(18)
+        for fn in range(3):
+            self.post_frame_seq[fn*6:fn*6+4] = self.post_frame_cmds
+            self.post_frame_seq[fn*6+4] = 0x81
+            self.post_frame_seq[fn*6+5] = adj[fn]
 
         # It's important to avoid using regular variables for thread sychronisation.
         # instead, elements of an array/bytearray should be used. We're using a uint32 array here, as that
         # should hopefully further ensure the atomicity of any element accesses.
+        # The RP2040's inter-core FIFOs can't be used instead, as micropython uses them to pause core 1
+        # while writing to flash, and its handler on core 1 would swallow anything we sent. Locks from _thread
+        # can't be used either, as the display thread would have to call into flash-based code to release them.
         self._state = array('I', [0,0,0,0xff])
 
-        self.pending_cmds = bytearray([0] * 8)
+        self.pending_cmds = bytearray(8)
 
-        self.load_font('lib/font5x7.bin', 5, 7, 1)
-        #self.load_font('lib/font8x8.bin', 8, 8, 0)
+        # The font is read in the first time draw_text() is used, so it takes no memory if no text is drawn
+        self.font_bmap = None
 
         self.fill(0)
         self.copy_buffers()
@@ -301,6 +321,8 @@ class SSD1306_SPI_Grey:
             idle()
 
 
+    # The buffers are 90 words long, so three words are done per iteration, which cuts the
+    # loop overhead without needing to handle any words left over
     @micropython.viper
     def copy_buffers(self):
         b1:ptr32 = ptr32(self.buffer1) ; b2:ptr32 = ptr32(self.buffer2)
@@ -312,7 +334,17 @@ class SSD1306_SPI_Grey:
             _b1[i] = v1 | v2
             _b2[i] = v2
             _b3[i] = v1 & v2
-            i += 1
+            v1 = b1[i+1]
+            v2 = b2[i+1]
+            _b1[i+1] = v1 | v2
+            _b2[i+1] = v2
+            _b3[i+1] = v1 & v2
+            v1 = b1[i+2]
+            v2 = b2[i+2]
+            _b1[i+2] = v1 | v2
+            _b2[i+2] = v2
+            _b3[i+2] = v1 & v2
+            i += 3
         self._state[SSD1306_SPI_Grey_StateIndex_CopyBuffs] = 0
 
 
@@ -321,13 +353,13 @@ class SSD1306_SPI_Grey:
     # any of micropython's flash-based native code.
     # Since flash XIP (eXecute In Place) is disabled during flash program or erase operations, by ensuring that
     # core 1 never tries to run flash-based code we avoid a crash/hang if core 0 tries to write to a file.
+    # The delays spin on the hardware timer's raw microsecond count (TIMERAWL), so they're accurate to a
+    # few cycles. Waiting for a timer alarm instead would only save power, as core 1 has nothing else to do.
     @micropython.viper
     def _display_thread(self):
-        buffers:ptr32 = ptr32(array('L', [ptr8(self._buffer1), ptr8(self._buffer2), ptr8(self._buffer3)]))
-        post_frame_adj:ptr32 = ptr32(array('L', [ptr8(self.post_frame_adj[0]), ptr8(self.post_frame_adj[1]), ptr8(self.post_frame_adj[2])]))
         state:ptr32 = ptr32(self._state)
         pre_frame_cmds:ptr8 = ptr8(self.pre_frame_cmds)
-        post_frame_cmds:ptr8 = ptr8(self.post_frame_cmds)
+        post_frame_seq:ptr8 = ptr8(self.post_frame_seq)
 
         spi0:ptr32 = ptr32(0x4003c000)
         tmr:ptr32 = ptr32(0x40054000)
@@ -337,9 +369,9 @@ class SSD1306_SPI_Grey:
         _b1:ptr32 = ptr32(self._buffer1) ; _b2:ptr32 = ptr32(self._buffer2) ; _b3:ptr32 = ptr32(self._buffer3)
         pending_cmds:ptr8 = ptr8(self.pending_cmds)
 
-        fn:int ; i:int ; t0:int
+        fn:int ; i:int ; t0:int ; seq:int
         v1:int ; v2:int ; contrast:int
-        spibuff:ptr8
+        spiword:ptr32
 
         while state[SSD1306_SPI_Grey_StateIndex_State] == SSD1306_SPI_Grey_ThreadState_Waiting:
             pass
@@ -361,12 +393,26 @@ class SSD1306_SPI_Grey:
                 while (spi0[3] & 4) == 4: i = spi0[2]
 
                 sio[5] = 1 << 17 # dc(1)
-                #spi_write(buffers[fn])
+                #spi_write(sub-frame buffer)
+                # The pixel data is read a word at a time, and as the transmit FIFO has room for 8 bytes,
+                # all four bytes can be written once it's empty, rather than checking for room before each
+                # byte. The byte being shifted out when it empties gives us time to refill it.
+                # The sub-frame's buffer is picked from the pointers we already have, rather than
+                # building an array of addresses to index
                 i = 0
-                spibuff:ptr8 = ptr8(buffers[fn])
-                while i < 360:
-                    while (spi0[3] & 2) == 0: pass
-                    spi0[2] = spibuff[i]
+                if fn == 0:
+                    spiword = _b1
+                elif fn == 1:
+                    spiword = _b2
+                else:
+                    spiword = _b3
+                while i < 90:
+                    v1 = spiword[i]
+                    while (spi0[3] & 1) == 0: pass
+                    spi0[2] = v1 & 0xff
+                    spi0[2] = (v1 >> 8) & 0xff
+                    spi0[2] = (v1 >> 16) & 0xff
+                    spi0[2] = (v1 >> 24) & 0xff
                     i += 1
                 while (spi0[3] & 4) == 4: i = spi0[2]
                 while (spi0[3] & 0x10) == 0x10: pass
@@ -374,11 +420,11 @@ class SSD1306_SPI_Grey:
 
                 sio[6] = 1 << 17 # dc(0)
                 #spi_write(post_frame_adj[fn], 2)
-                i = 0
-                spibuff:ptr8 = ptr8(post_frame_adj[fn])
-                while i < 2:
+                seq = fn * 6
+                i = seq + 4
+                while i < seq + 6:
                     while (spi0[3] & 2) == 0: pass
-                    spi0[2] = spibuff[i]
+                    spi0[2] = post_frame_seq[i]
                     i += 1
                 while (spi0[3] & 4) == 4: i = spi0[2]
                 while (spi0[3] & 0x10) == 0x10: pass
@@ -388,24 +434,19 @@ class SSD1306_SPI_Grey:
                     pass
 
                 time_out = tmr[10] + SSD1306_SPI_Grey_frame_time_us
-                #spi_write(post_frame_cmds, 4)
-                i = 0
-                while i < 4:
-                    while (spi0[3] & 2) == 0: pass
-                    spi0[2] = post_frame_cmds[i]
-                    i += 1
-                #spi_write(post_frame_adj[fn], 2)
-                i = 0
-                spibuff:ptr8 = ptr8(post_frame_adj[fn])
-                while i < 2:
+                #spi_write(post_frame_cmds + post_frame_adj[fn], 6)
+                i = seq
+                while i < seq + 6:
                     while (spi0[3] & 2) == 0: pass
-                    spi0[2] = spibuff[i]
+                    spi0[2] = post_frame_seq[i]
                     i += 1
                 while (spi0[3] & 4) == 4: i = spi0[2]
                 while (spi0[3] & 0x10) == 0x10: pass
                 while (spi0[3] & 4) == 4: i = spi0[2]
 
                 if (fn == 2) and (state[SSD1306_SPI_Grey_StateIndex_CopyBuffs] != 0):
+                    # the same as copy_buffers(). Calling that, or even an asm_thumb version of it, would
+                    # go through micropython's function call code, which runs from flash, so it's inlined.
                     i = 0
                     while i < 90:
                         v1 = b1[i]
@@ -413,14 +454,24 @@ class SSD1306_SPI_Grey:
                         _b1[i] = v1 | v2
                         _b2[i] = v2
                         _b3[i] = v1 & v2
-                        i += 1
+                        v1 = b1[i+1]
+                        v2 = b2[i+1]
+                        _b1[i+1] = v1 | v2
+                        _b2[i+1] = v2
+                        _b3[i+1] = v1 & v2
+                        v1 = b1[i+2]
+                        v2 = b2[i+2]
+                        _b1[i+2] = v1 | v2
+                        _b2[i+2] = v2
+                        _b3[i+2] = v1 & v2
+                        i += 3
                     state[SSD1306_SPI_Grey_StateIndex_CopyBuffs] = 0
                 elif (fn == 2) and (state[SSD1306_SPI_Grey_StateIndex_ContrastChng] != 0xff):
                     contrast = state[SSD1306_SPI_Grey_StateIndex_ContrastChng]
                     state[SSD1306_SPI_Grey_StateIndex_ContrastChng] = 0xff
-                    ptr8(post_frame_adj[0])[1] = contrast >> 6
-                    ptr8(post_frame_adj[1])[1] = contrast >> 1
-                    ptr8(post_frame_adj[2])[1] = contrast
+                    post_frame_seq[5] = contrast >> 6
+                    post_frame_seq[11] = contrast >> 1
+                    post_frame_seq[17] = contrast
                 elif state[SSD1306_SPI_Grey_StateIndex_PendingCmd]:
                     i = 0
                     while i < 8:
@@ -451,6 +502,7 @@ class SSD1306_SPI_Grey:
         self._state[SSD1306_SPI_Grey_StateIndex_State] = SSD1306_SPI_Grey_ThreadState_Stopped
 
 
+    # Like copy_buffers(), three words are done per iteration to cut the loop overhead
     @micropython.viper
     def fill(self, s:int):
         buffer1:ptr32 = ptr32(self.buffer1)
@@ -461,7 +513,11 @@ class SSD1306_SPI_Grey:
         while i < 90:
             buffer1[i] = f1
             buffer2[i] = f2
-            i += 1
+            buffer1[i+1] = f1
+            buffer2[i+1] = f2
+            buffer1[i+2] = f1
+            buffer2[i+2] = f2
+            i += 3
 
 
     '''
@@ -770,6 +826,9 @@ class SSD1306_SPI_Grey:
 
     @micropython.viper
     def draw_text(self, txt, x:int, y:int, shade:int):
+        if not self.font_bmap:
+            self.load_font('lib/font5x7.bin', 5, 7, 1)
+            #self.load_font('lib/font8x8.bin', 8, 8, 0)
         buffer1:ptr8 = ptr8(self.buffer1)
         buffer2:ptr8 = ptr8(self.buffer2)
         font_bmap:ptr8 = ptr8(self.font_bmap)
@@ -784,6 +843,9 @@ class SSD1306_SPI_Grey:
         ol:int = ou + 72
         shu:int = y & 7
         shl:int = 8 - shu
+        # Glyphs that are completely on screen are drawn without checking each column. The lower
+        # byte row is only needed if the text isn't aligned to a byte row, so y can go down to 32.
+        y_in:bool = 0 <= y <= 32
         for c in txt:
             if isinstance(c, str):
                 co:int = int(ord(c)) - 0x20
@@ -791,24 +853,40 @@ class SSD1306_SPI_Grey:
                 co:int = int(c) - 0x20
             if co < font_glyphcnt:
                 gi:int = co * font_width
-                gx:int = 0
-                while gx < font_width:
-                    if 0 <= x < 72:
-                        gb:int = font_bmap[gi + gx]
+                if y_in and 0 <= x and x + font_width <= 72:
+                    ge:int = gi + font_width
+                    while gi < ge:
+                        gb:int = font_bmap[gi]
                         gbu:int = gb << shu
-                        gbl:int = gb >> shl
-                        if 0 <= ou < 360:
-                            # paint upper byte
-                            buffer1[ou] = (buffer1[ou] | (gbu & sm1o)) & 255-(gbu & sm1a)
-                            buffer2[ou] = (buffer2[ou] | (gbu & sm2o)) & 255-(gbu & sm2a)
-                        if (shl != 8) and (0 <= ol < 360):
-                            # paint lower byte
+                        buffer1[ou] = (buffer1[ou] | (gbu & sm1o)) & 255-(gbu & sm1a)
+                        buffer2[ou] = (buffer2[ou] | (gbu & sm2o)) & 255-(gbu & sm2a)
+                        if shu:
+                            gbl:int = gb >> shl
                             buffer1[ol] = (buffer1[ol] | (gbl & sm1o)) & 255-(gbl & sm1a)
                             buffer2[ol] = (buffer2[ol] | (gbl & sm2o)) & 255-(gbl & sm2a)
-                    ou += 1
-                    ol += 1
-                    x += 1
-                    gx += 1
+                        ou += 1
+                        ol += 1
+                        gi += 1
+                    x += font_width
+                else:
+                    gx:int = 0
+                    while gx < font_width:
+                        if 0 <= x < 72:
+                            gb:int = font_bmap[gi + gx]
+                            gbu:int = gb << shu
+                            gbl:int = gb >> shl
+                            if 0 <= ou < 360:
+                                # paint upper byte
+                                buffer1[ou] = (buffer1[ou] | (gbu & sm1o)) & 255-(gbu & sm1a)
+                                buffer2[ou] = (buffer2[ou] | (gbu & sm2o)) & 255-(gbu & sm2a)
+                            if (shl != 8) and (0 <= ol < 360):
+                                # paint lower byte
+                                buffer1[ol] = (buffer1[ol] | (gbl & sm1o)) & 255-(gbl & sm1a)
+                                buffer2[ol] = (buffer2[ol] | (gbl & sm2o)) & 255-(gbl & sm2a)
+                        ou += 1
+                        ol += 1
+                        x += 1
+                        gx += 1
             ou += font_space
             ol += font_space
             x += font_space
@@ -817,9 +895,9 @@ class SSD1306_SPI_Grey:
     '''
     @micropython.viper
     def blit(self, src1:ptr8, src2:ptr8, x:int, y:int, width:int, height:int, key:int, mirrorX:int, mirrorY:int):
-        if x+width < 0 or x >= 72:
+        if x+width <= 0 or x >= 72:
             return
-        if y+height < 0 or y >= 40:
+        if y+height <= 0 or y >= 40:
             return
         buffer1:ptr8 = ptr8(self.buffer1)
         buffer2:ptr8 = ptr8(self.buffer2)
@@ -858,59 +936,80 @@ class SSD1306_SPI_Grey:
             height = 40 - dsty
 
         srco:int = (srcy >> 3) * stride + srcx
-        srcm:int = 1 << (srcy & 7)
+        srcb:int = srcy & 7
 
         dsto:int = (dsty >> 3) * 72 + dstx
         dstm:int = 1 << (dsty & 7)
         dstim:int = 255 - dstm
 
+        # For whole bytes, the pixels matching the key are the bits where both planes match the key's bits
+        k1:int = 0 if key & 1 else 0xff
+        k2:int = 0 if key & 2 else 0xff
+        kon:int = 0 if key == -1 else 0xff
+
         while height != 0:
-            srcco:int = srco
-            dstco:int = dsto
-            i:int = width
+            # When a whole byte of the source lines up with a whole byte of the display, 8 rows
+            # are merged at a time rather than going pixel by pixel
+            if dstm == 1 and srcb == 0 and height >= 8 and mirrorY == 0:
+                srcco:int = srco
+                dstco:int = dsto
+                i:int = width
+                while i != 0:
+                    v1:int = src1[srcco]
+                    v2:int = src2[srcco]
+                    m:int = 0xff ^ (((v1 ^ k1) & (v2 ^ k2)) & kon)
+                    # bytes without any of the key are just copied, and ones entirely of the key are skipped
+                    if m == 0xff:
+                        buffer1[dstco] = v1
+                        buffer2[dstco] = v2
+                    elif m != 0:
+                        im:int = 0xff ^ m
+                        buffer1[dstco] = (buffer1[dstco] & im) | (v1 & m)
+                        buffer2[dstco] = (buffer2[dstco] & im) | (v2 & m)
+                    srcco += sdx
+                    dstco += 1
+                    i -= 1
+                srco += stride
+                dsto += 72
+                height -= 8
+                continue
+            srcco = srco
+            dstco = dsto
+            i = width
             while i != 0:
-                v:int = 0
-                if src1[srcco] & srcm:
-                    v = 1
-                if src2[srcco] & srcm:
-                    v |= 2
+                v:int = ((src1[srcco] >> srcb) & 1) | (((src2[srcco] >> srcb) & 1) << 1)
                 if (key == -1) or (v != key):
-                    if v & 1:
-                        buffer1[dstco] |= dstm
-                    else:
-                        buffer1[dstco] &= dstim
-                    if v & 2:
-                        buffer2[dstco] |= dstm
-                    else:
-                        buffer2[dstco] &= dstim
+                    # 0 - bit is all ones when the bit is set, so it picks out dstm without a branch
+                    buffer1[dstco] = (buffer1[dstco] & dstim) | ((0 - (v & 1)) & dstm)
+                    buffer2[dstco] = (buffer2[dstco] & dstim) | ((0 - (v >> 1)) & dstm)
                 srcco += sdx
                 dstco += 1
                 i -= 1
+            # Move down a row, and onto the next page once the mask has shifted out of the byte.
+            # A shift is as quick as a table lookup here, so the masks are just recalculated.
             dstm <<= 1
-            if dstm & 0x100:
+            if dstm == 0x100:
                 dsto += 72
                 dstm = 1
-                dstim = 0xfe
-            else:
-                dstim = 255 - dstm
+            dstim = 255 - dstm
             if mirrorY:
-                srcm >>= 1
-                if srcm == 0:
+                srcb -= 1
+                if srcb < 0:
                     srco -= stride
-                    srcm = 0x80
+                    srcb = 7
             else:
-                srcm <<= 1
-                if srcm & 0x100:
+                srcb += 1
+                if srcb == 8:
                     srco += stride
-                    srcm = 1
+                    srcb = 0
             height -= 1
 
 
     @micropython.viper
     def blit_mask(self, src1:ptr8, src2:ptr8, x:int, y:int, width:int, height:int, mask:ptr8, mirrorX:int, mirrorY:int):
-        if x+width < 0 or x >= 72:
+        if x+width <= 0 or x >= 72:
             return
-        if y+height < 0 or y >= 40:
+        if y+height <= 0 or y >= 40:
             return
         buffer1:ptr8 = ptr8(self.buffer1)
         buffer2:ptr8 = ptr8(self.buffer2)
@@ -949,75 +1048,94 @@ class SSD1306_SPI_Grey:
             height = 40 - dsty
 
         srco:int = (srcy >> 3) * stride + srcx
-        srcm:int = 1 << (srcy & 7)
+        srcb:int = srcy & 7
 
         dsto:int = (dsty >> 3) * 72 + dstx
         dstm:int = 1 << (dsty & 7)
         dstim:int = 255 - dstm
 
         while height != 0:
-            srcco:int = srco
-            dstco:int = dsto
-            i:int = width
+            # As in blit(), 8 rows are merged at a time when the source and display bytes line up
+            if dstm == 1 and srcb == 0 and height >= 8 and mirrorY == 0:
+                srcco:int = srco
+                dstco:int = dsto
+                i:int = width
+                while i != 0:
+                    m:int = mask[srcco] ^ 0xff
+                    # fully opaque bytes are just copied, and fully transparent ones are skipped
+                    if m == 0xff:
+                        buffer1[dstco] = src1[srcco]
+                        buffer2[dstco] = src2[srcco]
+                    elif m != 0:
+                        im:int = 0xff ^ m
+                        buffer1[dstco] = (buffer1[dstco] & im) | (src1[srcco] & m)
+                        buffer2[dstco] = (buffer2[dstco] & im) | (src2[srcco] & m)
+                    srcco += sdx
+                    dstco += 1
+                    i -= 1
+                srco += stride
+                dsto += 72
+                height -= 8
+                continue
+            srcco = srco
+            dstco = dsto
+            i = width
             while i != 0:
-                if (mask[srcco] & srcm) == 0:
-                    if src1[srcco] & srcm:
-                        buffer1[dstco] |= dstm
-                    else:
-                        buffer1[dstco] &= dstim
-                    if src2[srcco] & srcm:
-                        buffer2[dstco] |= dstm
-                    else:
-                        buffer2[dstco] &= dstim
+                if ((mask[srcco] >> srcb) & 1) == 0:
+                    buffer1[dstco] = (buffer1[dstco] & dstim) | ((0 - ((src1[srcco] >> srcb) & 1)) & dstm)
+                    buffer2[dstco] = (buffer2[dstco] & dstim) | ((0 - ((src2[srcco] >> srcb) & 1)) & dstm)
                 srcco += sdx
                 dstco += 1
                 i -= 1
+            # Move down a row, and onto the next page once the mask has shifted out of the byte
             dstm <<= 1
-            if dstm & 0x100:
+            if dstm == 0x100:
                 dsto += 72
                 dstm = 1
-                dstim = 0xfe
-            else:
-                dstim = 255 - dstm
+            dstim = 255 - dstm
             if mirrorY:
-                srcm >>= 1
-                if srcm == 0:
+                srcb -= 1
+                if srcb < 0:
                     srco -= stride
-                    srcm = 0x80
+                    srcb = 7
             else:
-                srcm <<= 1
-                if srcm & 0x100:
+                srcb += 1
+                if srcb == 8:
                     srco += stride
-                    srcm = 1
+                    srcb = 0
             height -= 1
 
 
+    # The display is filled a page at a time. For each group of 4 columns, the source bytes from
+    # the page's 8 rows are gathered into a word per plane, with a byte per column, so every display
+    # byte is written once rather than having a bit changed for each row. As the words line up with
+    # the display's columns, they're stored whole.
+    # Multiplying a byte's bits for one plane (every other bit) by 0x41041 spreads them 6, 12 and
+    # 18 bits further. With the 0x01010101 mask that leaves bit 2n at the bottom of byte n. Where the
+    # copies overlap, the carries only reach odd bits, which are masked off.
     @micropython.viper
     def copy_from_gs2hmsb(self, buf:ptr8):
-        buffer1 = ptr8(self.buffer1)
-        buffer2 = ptr8(self.buffer2)
-        i:int = 0
-        oy:int = 0
-        for y in range(5):
-            for yy in range(8):
-                m:int = 1 << yy
-                im:int = 255 - m
-                for x in range(0, 72, 4):
-                    oi:int = oy + x
-                    c:int = buf[i]
-                    i += 1
-                    for xx in range(4):
-                        oixx:int = oi + xx
-                        cc:int = c & 3
-                        if cc & 1:
-                            buffer1[oixx] |= m
-                        else:
-                            buffer1[oixx] &= im
-                        if cc & 2:
-                            buffer2[oixx] |= m
-                        else:
-                            buffer2[oixx] &= im
-                        c >>= 2
-            oy += 72
+        buffer1 = ptr32(self.buffer1)
+        buffer2 = ptr32(self.buffer2)
+        o:int = 0
+        row:int = 0
+        while o < 90:
+            x:int = 0
+            while x < 18:
+                w1:int = 0
+                w2:int = 0
+                si:int = row + x
+                yy:int = 0
+                while yy < 8:
+                    c:int = buf[si]
+                    w1 |= (((c & 0x55) * 0x41041) & 0x01010101) << yy
+                    w2 |= ((((c >> 1) & 0x55) * 0x41041) & 0x01010101) << yy
+                    si += 18
+                    yy += 1
+                buffer1[o] = w1
+                buffer2[o] = w2
+                o += 1
+                x += 1
+            row += 144
 
     '''